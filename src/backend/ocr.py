@@ -1,47 +1,159 @@
-import tempfile
-from typing import Any, Dict, List, Optional
+import hashlib
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
 import pytesseract
-from pdf2image import convert_from_path
+from pdf2image import convert_from_path, pdfinfo_from_path
+from PIL.Image import Image
 from tqdm import tqdm
 
+from helper import cache
+
+# text of each page image, one evictable file per image key
+FOLDER_CACHE_OCR = "ocr_pages"
+
+# number of consecutive pages rasterized at once
+PAGES_PER_WINDOW = 4
+
+
+def _ocr_image(image: Image, language: str) -> Tuple[str, float]:
+    start = time.perf_counter()
+    text = pytesseract.image_to_string(image, lang=language)
+    return text, time.perf_counter() - start
+
+
+def _compute_image_key(image: Image, dpi: int, language: str) -> str:
+    return f"{hashlib.sha1(image.tobytes()).hexdigest()}_{dpi}_{language}"
+
+
+def _compute_windows(pages: List[int]) -> List[Tuple[int, int]]:
+    # group the sorted pages into runs of consecutive pages, each run being cut
+    # into windows of at most PAGES_PER_WINDOW pages
+    windows = []
+    for page in sorted(set(pages)):
+        if (
+            windows
+            and windows[-1][1] == page - 1
+            and page - windows[-1][0] < PAGES_PER_WINDOW
+        ):
+            windows[-1] = (windows[-1][0], page)
+        else:
+            windows.append((page, page))
+    return windows
+
+
+def rasterize_pdf(pdf_path, pages: List[int], dpi: int) -> Iterator[Tuple[int, Image]]:
+    # only one window of images is in memory at a time
+    for first_page, last_page in _compute_windows(pages):
+        images = convert_from_path(
+            pdf_path, dpi=dpi, first_page=first_page, last_page=last_page
+        )
+        yield from zip(range(first_page, last_page + 1), images)
+
+
+def ocr_images(
+    images: Iterable[Tuple[int, Image]],
+    language: str = "eng",
+    dpi: int = 300,
+    total: Optional[int] = None,
+    max_workers: Optional[int] = None,
+    seconds_by_page: Optional[Dict[int, float]] = None,
+    errors_by_page: Optional[Dict[int, str]] = None,
+) -> Dict[int, str]:
+    """
+    Performs OCR on page images with a pool of tesseract workers.
+
+    Args:
+        images: Iterable of (page number, image), consumed lazily
+        language: Language for OCR
+        dpi: DPI the images were rendered with, part of the cache key
+        total: Number of images, only used for the progress bar
+        max_workers: Number of tesseract processes. Default is the number of cpus
+        seconds_by_page: If given, filled with the OCR time of each page (0 if cached)
+        errors_by_page: If given, filled with the error of each page whose OCR
+            failed, the other pages going on. Else the first error is raised
+
+    Returns:
+        The text of each page number, the failed pages excluded
+    """
+
+    max_workers = max_workers or os.cpu_count() or 1
+    seconds_by_page = {} if seconds_by_page is None else seconds_by_page
+
+    text_by_page: Dict[int, str] = {}
+    pending: Dict[Future, Tuple[int, str]] = {}
+
+    def collect(futures: Iterable[Future]) -> None:
+        for future in futures:
+            page, key = pending.pop(future)
+            try:
+                text, seconds_by_page[page] = future.result()
+            except Exception as e:
+                if errors_by_page is None:
+                    raise
+                errors_by_page[page] = f"{type(e).__name__}: {e}"
+                continue
+            text_by_page[page] = text
+            cache.save(f"{FOLDER_CACHE_OCR}/{key}.json", text)
+
+    # spawn : the caller may hold threads (streamlit, prefetch) unsafe to fork
+    with ProcessPoolExecutor(
+        max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        for page, image in tqdm(images, total=total, desc="OCR pages"):
+            key = _compute_image_key(image, dpi, language)
+            text = cache.load(f"{FOLDER_CACHE_OCR}/{key}.json")
+            if text is not None:
+                text_by_page[page] = text
+                seconds_by_page[page] = 0.0
+                continue
+
+            # bound the number of images waiting for a worker to keep memory flat
+            if len(pending) >= 2 * max_workers:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+
+            pending[executor.submit(_ocr_image, image, language)] = (page, key)
+
+        collect(list(pending))
+
+    return text_by_page
+
 
 def ocr_pdf(
-    pdf_path, pages: Optional[List[int]] = None, language="eng", dpi=300
+    pdf_path,
+    pages: Optional[List[int]] = None,
+    language="eng",
+    dpi=300,
+    max_workers: Optional[int] = None,
 ) -> List[str]:
     """
     Performs OCR on a PDF and return the text.
 
     Args:
         pdf_path (str): Path to the PDF file
-        output_path (str, optional): Path to save the output text. If None, uses the PDF name with .txt extension
+        pages (List[int], optional): Pages to OCR, starting at 1. If None, all the pages
         language (str, optional): Language for OCR. Default is 'eng'
         dpi (int, optional): DPI for rendering PDF. Higher is better quality but slower.
+        max_workers (int, optional): Number of tesseract processes. Default is the number of cpus
     """
 
-    # Create temp directory for storing images
-    with tempfile.TemporaryDirectory() as temp_dir:
-
-        # Convert PDF to images
-        try:
-            images = convert_from_path(pdf_path, dpi=dpi)
-            print(f"PDF converted to {len(images)} images.")
-        except Exception as e:
-            print(f"Error converting PDF: {e}")
-            return None
-
+    try:
         if pages is None:
-            pages = list(range(len(images)))
-
-        # Process each page
-        text_per_page = []
-        for i, image in tqdm(list(enumerate(images)), desc="OCR pages"):
-            page_number = i + 1
-            if not page_number in pages:
-                continue
+            pages = list(range(1, pdfinfo_from_path(pdf_path)["Pages"] + 1))
 
-            # Perform OCR
-            text = pytesseract.image_to_string(image, lang=language)
-            text_per_page.append(text)
+        text_by_page = ocr_images(
+            rasterize_pdf(pdf_path, pages, dpi),
+            language=language,
+            dpi=dpi,
+            total=len(set(pages)),
+            max_workers=max_workers,
+        )
+    except Exception as e:
+        print(f"Error converting PDF: {e}")
+        return None
 
-    return text_per_page
+    return [text_by_page[page] for page in sorted(set(pages))]
@@ -0,0 +1,275 @@
+import hashlib
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from backend.rag.quantization import ENCODINGS, Quantizer
+from backend.rag.retrieval import normalize, search, top_k
+from helper import cache
+
+FOLDER_ANN_INDEX = "ann_index"
+
+# under this number of vectors, no clustering : brute force is as fast
+MIN_VECTORS_IVF = 20_000
+# a filtered search over fewer allowed vectors than this is done by brute force
+MAX_ALLOWED_BRUTE_FORCE = 20_000
+
+# inverted lists : about LISTS_PER_SQRT * sqrt(n) of them
+LISTS_PER_SQRT = 2
+# lists visited per query, doubled while the allowed candidates are too few
+NB_PROBES = 32
+
+# with compact codes, this many candidates per result are rescored exactly
+RESCORE_FACTOR = 10
+
+KMEANS_ITERATIONS = 10
+KMEANS_POINTS_PER_LIST = 64
+BLOCK_SIZE_ASSIGN = 65_536
+# rows of the embeddings hashed at once : no full copy of a memory-mapped file
+BLOCK_SIZE_HASH = 65_536
+
+# recall@K_RECALL of the index against the exact search, on NB_QUERIES_RECALL
+# queries between two random embeddings
+K_RECALL = 10
+NB_QUERIES_RECALL = 200
+
+# indexes loaded in this process, by filename : shared by the sessions
+_indexes: Dict[str, "AnnIndex"] = {}
+_lock_indexes = threading.Lock()
+
+
+def _assign(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    return np.concatenate(
+        [
+            np.argmax(vectors[start : start + BLOCK_SIZE_ASSIGN] @ centroids.T, axis=1)
+            for start in range(0, len(vectors), BLOCK_SIZE_ASSIGN)
+        ]
+    )
+
+
+def _train_centroids(vectors: np.ndarray, nb_lists: int, seed: int) -> np.ndarray:
+    # spherical k-means on a sample
+    rng = np.random.default_rng(seed)
+    nb_samples = min(len(vectors), nb_lists * KMEANS_POINTS_PER_LIST)
+    sample = vectors[rng.choice(len(vectors), nb_samples, replace=False)]
+
+    centroids = sample[rng.choice(nb_samples, nb_lists, replace=False)]
+    for _ in range(KMEANS_ITERATIONS):
+        lists = _assign(sample, centroids)
+
+        # sum of the points of each list, on the points sorted by list
+        order = np.argsort(lists, kind="stable")
+        counts = np.bincount(lists, minlength=nb_lists)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        sums = np.add.reduceat(sample[order], np.minimum(starts, nb_samples - 1))
+
+        # empty lists are re-seeded on random points
+        empty = counts == 0
+        sums[empty] = sample[rng.choice(nb_samples, empty.sum())]
+        centroids = normalize(sums)
+
+    return centroids
+
+
+class AnnIndex:
+    """
+    Inverted-file index of normalized embeddings, searched by cosine
+    similarity. The vectors are stored grouped by list (nearest centroid) ; a
+    query visits the lists of its nearest centroids. A search can be
+    restricted to allowed row ids (the filters) : small allowed sets, and
+    small corpora, are scanned entirely.
+
+    The vectors are stored as the codes of a Quantizer. With compact codes,
+    the best candidates of the codes are rescored exactly on the float
+    embeddings, if attached (set_embeddings, e.g. memory-mapped).
+    """
+
+    def __init__(
+        self,
+        embeddings: np.ndarray,
+        encoding: str = "float32",
+        pca_dims: Optional[int] = None,
+        seed: int = 0,
+    ):
+        vectors = normalize(embeddings)
+        self.nb_vectors = len(vectors)
+        self.quantizer = Quantizer(encoding, pca_dims).fit(vectors, seed)
+        self.embeddings: Optional[np.ndarray] = None
+
+        if self.nb_vectors < MIN_VECTORS_IVF:
+            self.centroids = np.zeros((0, vectors.shape[1]), dtype=np.float32)
+            lists = np.zeros(self.nb_vectors, dtype=np.int64)
+            nb_lists = 1
+        else:
+            nb_lists = int(LISTS_PER_SQRT * np.sqrt(self.nb_vectors))
+            self.centroids = _train_centroids(vectors, nb_lists, seed)
+            lists = _assign(vectors, self.centroids)
+
+        # vectors grouped by list : list i is ids[offsets[i]:offsets[i + 1]]
+        self.ids = np.argsort(lists, kind="stable")
+        self.offsets = np.concatenate(
+            [[0], np.cumsum(np.bincount(lists, minlength=nb_lists))]
+        )
+        self.codes = self.quantizer.encode(vectors[self.ids])
+        self.positions = np.empty(self.nb_vectors, dtype=np.int64)
+        self.positions[self.ids] = np.arange(self.nb_vectors)
+
+    def __getstate__(self) -> dict:
+        # the float embeddings are not persisted with the index
+        return {**self.__dict__, "embeddings": None}
+
+    def set_embeddings(self, embeddings: np.ndarray) -> None:
+        assert len(embeddings) == self.nb_vectors
+        self.embeddings = embeddings
+
+    def _is_exact(self) -> bool:
+        return self.quantizer.encoding == "float32" and self.quantizer.pca_dims is None
+
+    def _select(
+        self, query: np.ndarray, k: int, positions: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        # k best of the positions : on the codes, then exactly if possible
+        scores = self.quantizer.score(
+            self.codes[positions], self.quantizer.prepare_query(query)
+        )
+        if self._is_exact():
+            best = top_k(scores, k)
+            return self.ids[positions[best]], scores[best]
+
+        best = top_k(scores, k * RESCORE_FACTOR)
+        candidates = self.ids[positions[best]]
+        if self.embeddings is None:  # approximate scores only
+            return candidates[:k], scores[best[:k]]
+
+        # sorted ids : contiguous reads of the memory-mapped embeddings
+        candidates = np.sort(candidates)
+        scores = normalize(self.embeddings[candidates]) @ query
+        best = top_k(scores, k)
+        return candidates[best], scores[best]
+
+    def search(
+        self,
+        query: np.ndarray,
+        k: int,
+        allowed: Optional[np.ndarray] = None,
+        nb_probes: int = NB_PROBES,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Ids and cosine similarities of the k nearest vectors, best first."""
+
+        query = normalize(query).reshape(-1)
+        allowed = None if allowed is None else np.asarray(allowed, dtype=np.int64)
+
+        # 1. all the candidates when it is as fast
+        nb_candidates = self.nb_vectors if allowed is None else len(allowed)
+        if len(self.centroids) == 0 or nb_candidates <= MAX_ALLOWED_BRUTE_FORCE:
+            if allowed is None:
+                return self._select(query, k, np.arange(self.nb_vectors))
+            return self._select(query, k, self.positions[allowed])
+
+        mask_allowed = None
+        if allowed is not None:
+            mask_allowed = np.zeros(self.nb_vectors, dtype=bool)
+            mask_allowed[allowed] = True
+
+        # 2. visit the nearest lists, more of them if too few allowed candidates
+        order_lists = np.argsort(-(self.centroids @ query))
+        nb_probes = min(nb_probes, len(order_lists))
+        while True:
+            positions = np.concatenate(
+                [
+                    np.arange(self.offsets[idx], self.offsets[idx + 1])
+                    for idx in order_lists[:nb_probes]
+                ]
+            )
+            if mask_allowed is not None:
+                positions = positions[mask_allowed[self.ids[positions]]]
+            if len(positions) >= k or nb_probes == len(order_lists):
+                break
+            nb_probes = min(2 * nb_probes, len(order_lists))
+
+        return self._select(query, k, positions)
+
+    # ----------------- Cache -----------------
+
+    @staticmethod
+    def _filename(embeddings: np.ndarray, *params) -> str:
+        sha = hashlib.sha1(str(embeddings.shape).encode())
+        for start in range(0, len(embeddings), BLOCK_SIZE_HASH):
+            block = embeddings[start : start + BLOCK_SIZE_HASH]
+            sha.update(np.ascontiguousarray(block, dtype=np.float32).tobytes())
+        key = cache.compute_key([sha.hexdigest(), MIN_VECTORS_IVF, *params])
+        return f"{FOLDER_ANN_INDEX}/{key}.pkl"
+
+    @classmethod
+    def load_or_build(
+        cls,
+        embeddings: np.ndarray,
+        encoding: str = "float32",
+        pca_dims: Optional[int] = None,
+    ) -> "AnnIndex":
+        # persisted by the content of the embeddings, rescoring on them. One
+        # instance per process, read-only once built.
+        filename = cls._filename(embeddings, encoding, pca_dims)
+        with _lock_indexes:
+            if filename not in _indexes:
+                index = cache.load(filename, memory_tier=False)
+                if index is None:
+                    print("Building ann index...")
+                    index = cls(embeddings, encoding, pca_dims)
+                    cache.save(filename, index)
+                index.set_embeddings(embeddings)
+                _indexes[filename] = index
+            return _indexes[filename]
+
+
+def check_recall(
+    embeddings: np.ndarray,
+    encodings: List[str] = ENCODINGS,
+    pca_dims: Optional[int] = None,
+    k: int = K_RECALL,
+    nb_queries: int = NB_QUERIES_RECALL,
+    seed: int = 0,
+) -> Dict[str, float]:
+    """
+    Recall of the index of each encoding (rescored on the embeddings, as when
+    searched) against the exact search, printed with its search time.
+    """
+
+    rng = np.random.default_rng(seed)
+    pairs = rng.choice(len(embeddings), (nb_queries, 2))
+    queries = normalize(
+        normalize(embeddings[pairs[:, 0]]) + normalize(embeddings[pairs[:, 1]])
+    )
+    exact = [set(search(embeddings, query, k)[0]) for query in queries]
+
+    recalls = {}
+    for encoding in encodings:
+        index = AnnIndex(embeddings, encoding, pca_dims, seed)
+        index.set_embeddings(embeddings)
+
+        start = time.perf_counter()
+        found = [index.search(query, k)[0] for query in queries]
+        seconds = (time.perf_counter() - start) / nb_queries
+
+        recalls[encoding] = float(
+            np.mean(
+                [
+                    len(ids_exact.intersection(ids)) / k
+                    for ids_exact, ids in zip(exact, found)
+                ]
+            )
+        )
+        print(
+            f"Recall@{k} {encoding} (pca {pca_dims}) : {recalls[encoding]:.3f} ; "
+            f"{seconds * 1e3:.2f}ms per query"
+        )
+
+    return recalls
+
+
+if __name__ == "__main__":
+    from backend.rag.saint_amand import PCA_DIMS_SAINT_AMAND, load_numerization
+
+    check_recall(load_numerization(), pca_dims=PCA_DIMS_SAINT_AMAND)
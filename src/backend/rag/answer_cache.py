@@ -0,0 +1,164 @@
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from backend.rag.retriever import ENCODER_BACKEND, get_encoder
+from helper import cache
+from vars import PATH_MODEL_MINI
+
+FOLDER_ANSWERS = "answers"
+
+# questions encoded kept in memory
+NB_QUESTION_EMBEDDINGS = 256
+
+# reuse the answer of a near question asked on the same chunks
+SEMANTIC_HITS = False
+COSINE_MIN_SEMANTIC = 0.95
+
+
+def normalize_question(question: str) -> str:
+    # same question up to the case, the spaces and the final punctuation
+    return " ".join(question.lower().split()).rstrip(" ?!.")
+
+
+class QuestionEmbeddings:
+    """LRU of the embeddings of the questions, by their text."""
+
+    def __init__(
+        self,
+        encode: Callable[[str], np.ndarray],
+        size: int = NB_QUESTION_EMBEDDINGS,
+    ):
+        self.encode = encode
+        self.size = size
+
+        self.embeddings: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, question: str) -> np.ndarray:
+        with self.lock:
+            if question in self.embeddings:
+                self.embeddings.move_to_end(question)
+                return self.embeddings[question]
+
+        embedding = np.asarray(self.encode(question), dtype=np.float32)
+
+        with self.lock:
+            self.embeddings[question] = embedding
+            while len(self.embeddings) > self.size:
+                self.embeddings.popitem(last=False)
+
+        return embedding
+
+
+# question embeddings of this process, shared by the sessions, by model path and
+# encoder backend
+_question_embeddings: Dict[str, QuestionEmbeddings] = {}
+_lock_question_embeddings = threading.Lock()
+
+
+def get_question_embeddings(
+    path_model: Path = PATH_MODEL_MINI, backend: str = ENCODER_BACKEND
+) -> QuestionEmbeddings:
+    """LRU shared by the whole process, the encoder being loaded on first use."""
+
+    key = f"{path_model} ({backend})"
+    with _lock_question_embeddings:
+        if key not in _question_embeddings:
+            _question_embeddings[key] = QuestionEmbeddings(
+                lambda question: get_encoder(path_model, backend).encode(question)
+            )
+        return _question_embeddings[key]
+
+
+class AnswerCache:
+    """
+    Answers of the llm persisted in the cache, one file per retrieved context
+    (chunks and instructions), holding the questions asked on it with their
+    filters. A question is a hit if asked before with the same filters, or,
+    in semantic mode, if its embedding is near one of them.
+    """
+
+    def __init__(
+        self,
+        semantic_hits: bool = SEMANTIC_HITS,
+        cosine_min: float = COSINE_MIN_SEMANTIC,
+    ):
+        self.semantic_hits = semantic_hits
+        self.cosine_min = cosine_min
+
+    @staticmethod
+    def _filename(contexts: List[str], instructions: List[str]) -> str:
+        key = cache.compute_key([contexts, instructions])
+        return f"{FOLDER_ANSWERS}/{key}.json"
+
+    def get(
+        self,
+        question: str,
+        filters_key: Optional[str],
+        contexts: List[str],
+        instructions: List[str],
+        question_embedding: Optional[np.ndarray] = None,
+    ) -> Optional[str]:
+
+        entries = cache.load(self._filename(contexts, instructions)) or []
+        entries = [entry for entry in entries if entry["filters"] == filters_key]
+
+        # 1. same question
+        question = normalize_question(question)
+        for entry in entries:
+            if entry["question"] == question:
+                return entry["answer"]
+
+        # 2. near question
+        entries = [entry for entry in entries if entry["embedding"] is not None]
+        if not self.semantic_hits or question_embedding is None or not entries:
+            return None
+        embeddings = np.array([entry["embedding"] for entry in entries])
+        similarities = (
+            embeddings
+            @ question_embedding
+            / np.maximum(
+                np.linalg.norm(embeddings, axis=1) * np.linalg.norm(question_embedding),
+                1e-12,
+            )
+        )
+        best = int(np.argmax(similarities))
+        if similarities[best] >= self.cosine_min:
+            return entries[best]["answer"]
+
+        return None
+
+    def add(
+        self,
+        question: str,
+        filters_key: Optional[str],
+        contexts: List[str],
+        instructions: List[str],
+        question_embedding: Optional[np.ndarray],
+        answer: str,
+    ) -> None:
+        entry = {
+            "question": normalize_question(question),
+            "filters": filters_key,
+            "embedding": (
+                None
+                if question_embedding is None
+                else np.round(question_embedding.astype(float), 6).tolist()
+            ),
+            "answer": answer,
+        }
+
+        def add_entry(entries: Optional[list]) -> list:
+            # replace the previous answer of the question, if any
+            return [
+                previous
+                for previous in entries or []
+                if (previous["question"], previous["filters"])
+                != (entry["question"], entry["filters"])
+            ] + [entry]
+
+        cache.update(self._filename(contexts, instructions), add_entry)
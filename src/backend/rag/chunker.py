@@ -0,0 +1,119 @@
+import json
+from functools import lru_cache
+from pathlib import Path
+from typing import Iterator, List, Optional
+
+import numpy as np
+from tokenizers import Tokenizer
+
+from vars import PATH_MODEL_MINI
+
+# tokens shared by two following chunks
+CHUNK_OVERLAP_TOKENS = 64
+
+SEPARATOR_PAGES = "\n"
+
+
+@lru_cache
+def load_tokenizer(path_model: Path) -> Tokenizer:
+    tokenizer = Tokenizer.from_file(str(path_model / "tokenizer.json"))
+    tokenizer.no_truncation()
+    tokenizer.no_padding()
+    return tokenizer
+
+
+@lru_cache
+def get_max_tokens(path_model: Path) -> int:
+    with open(path_model / "sentence_bert_config.json", mode="r") as fr:
+        max_seq_length = json.load(fr)["max_seq_length"]
+    # room for the [CLS] and [SEP] tokens added by the model
+    return max_seq_length - 2
+
+
+def get_chunk_params(path_model: Path = PATH_MODEL_MINI) -> dict:
+    return {
+        "tokenizer": path_model.name,
+        "max_tokens": get_max_tokens(path_model),
+        "overlap_tokens": CHUNK_OVERLAP_TOKENS,
+    }
+
+
+def compute_windows(n_tokens: int, max_tokens: int, overlap: int) -> np.ndarray:
+    """
+    Token windows [start, end) covering n_tokens, each one starting
+    `max_tokens - overlap` tokens after the previous one. The last one adds at
+    least one token not covered by the previous one.
+    """
+    if n_tokens == 0:
+        return np.zeros((0, 2), dtype=np.int64)
+
+    starts = np.arange(0, max(n_tokens - overlap, 1), max_tokens - overlap)
+    ends = np.minimum(starts + max_tokens, n_tokens)
+    return np.stack([starts, ends], axis=1)
+
+
+def snap_windows_to_words(
+    windows: np.ndarray, word_ids: List[Optional[int]], max_tokens: int
+) -> np.ndarray:
+    """
+    Move the windows to word boundaries : each start back to the first token of
+    its word, then each end back so that the window ends before the word it
+    would cut, still holding at most max_tokens. A word longer than a window is
+    cut.
+    """
+    n_tokens = len(word_ids)
+    if n_tokens == 0:
+        return windows
+
+    # first token of the word of each token
+    ids = np.array([-1 if w is None else w for w in word_ids], dtype=np.int64)
+    is_word_start = np.concatenate([[True], ids[1:] != ids[:-1]])
+    word_start = np.maximum.accumulate(np.where(is_word_start, np.arange(n_tokens), 0))
+
+    starts = word_start[windows[:, 0]]
+    ends = np.minimum(starts + max_tokens, n_tokens)
+    ends_cut = ends < n_tokens
+    snapped = np.where(ends_cut, word_start[np.minimum(ends, n_tokens - 1)], ends)
+    ends = np.where(snapped > starts, snapped, ends)
+
+    return np.stack([starts, ends], axis=1)
+
+
+def document_to_chunks(
+    pages: List[dict], path_model: Path = PATH_MODEL_MINI
+) -> Iterator[dict]:
+    """
+    Split the pages of one document into chunks of at most the model max number
+    of tokens. Each chunk keeps its character offsets in the document (pages
+    joined by SEPARATOR_PAGES) and the page where it starts.
+    """
+
+    if not pages:
+        return
+
+    # join the pages and remember where each one starts
+    texts = [page["text"] for page in pages]
+    text = SEPARATOR_PAGES.join(texts)
+    lengths = np.array([len(t) + len(SEPARATOR_PAGES) for t in texts])
+    page_starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    page_numbers = [page["page"] for page in pages]
+
+    # tokenize the whole document at once
+    encoding = load_tokenizer(path_model).encode(text, add_special_tokens=False)
+    offsets = np.array(encoding.offsets, dtype=np.int64).reshape((-1, 2))
+
+    # all the windows of the document
+    max_tokens = get_max_tokens(path_model)
+    windows = compute_windows(len(offsets), max_tokens, CHUNK_OVERLAP_TOKENS)
+    windows = snap_windows_to_words(windows, encoding.word_ids, max_tokens)
+    char_starts = offsets[windows[:, 0], 0]
+    char_ends = offsets[windows[:, 1] - 1, 1]
+    idx_pages = np.searchsorted(page_starts, char_starts, side="right") - 1
+
+    for char_start, char_end, idx_page in zip(char_starts, char_ends, idx_pages):
+        yield {
+            "chunk": text[char_start:char_end],
+            "page": page_numbers[idx_page],
+            "char_start": int(char_start),
+            "char_end": int(char_end),
+        }
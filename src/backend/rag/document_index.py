@@ -0,0 +1,52 @@
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from helper import cache
+
+FOLDER_INDEX = "custom_index"
+
+TYPE_ENTRY = Tuple[pd.DataFrame, np.ndarray]
+
+
+class DocumentIndex:
+    """
+    Chunks and embeddings of documents, persisted in the cache and keyed by the
+    hash of the file content, of the chunking parameters and of the encoder backend.
+    """
+
+    def __init__(self, chunk_params: dict, encoder_backend: str):
+        self.params_key = cache.compute_key(
+            {**chunk_params, "encoder_backend": encoder_backend}, length=12
+        )
+
+        # entries already loaded in this process
+        self.entries: Dict[str, TYPE_ENTRY] = {}
+
+    def _filenames(self, file_hash: str) -> Tuple[str, str]:
+        filename = f"{FOLDER_INDEX}/{file_hash}_{self.params_key}"
+        return filename + ".parquet", filename + ".pt"
+
+    def get(self, file_hash: str) -> Optional[TYPE_ENTRY]:
+        if file_hash in self.entries:
+            return self.entries[file_hash]
+
+        filename_chunks, filename_embeddings = self._filenames(file_hash)
+        df_chunks = cache.load(filename_chunks)
+        embeddings = cache.load(filename_embeddings)
+        if df_chunks is None or embeddings is None:
+            return None
+
+        self.entries[file_hash] = df_chunks, embeddings
+        return df_chunks, embeddings
+
+    def add(self, file_hash: str, df_chunks: pd.DataFrame, embeddings: np.ndarray):
+        assert len(df_chunks) == embeddings.shape[0]
+
+        filename_chunks, filename_embeddings = self._filenames(file_hash)
+        # embeddings first : an entry is only complete once its chunks are saved
+        cache.save(filename_embeddings, embeddings)
+        cache.save(filename_chunks, df_chunks)
+
+        self.entries[file_hash] = df_chunks, embeddings
@@ -0,0 +1,142 @@
+import threading
+from contextlib import closing
+from itertools import islice
+from pathlib import Path
+from queue import Full, Queue
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+from backend.rag.chunker import document_to_chunks
+from backend.rag.document_index import DocumentIndex
+from backend.rag.retriever import SentenceTransformerWrapper
+from backend.rag.scheduler import extract_files
+
+# number of chunks encoded at once
+BATCH_SIZE = 64
+
+# chunks read in advance while a batch is being encoded
+PREFETCH_SIZE = 4 * BATCH_SIZE
+# the producer checks this often whether the consumer stopped
+TIMEOUT_PUT_SECONDS = 0.1
+
+COLUMNS_CHUNKS = ["chunk", "page", "char_start", "char_end"]
+
+# (file hash, chunk) ; a None chunk marks the end of a file
+TYPE_ITEM = Tuple[str, Optional[dict]]
+
+
+def iter_chunks(
+    files: List[Tuple[Path, str]], stopped: Optional[threading.Event] = None
+) -> Iterator[TYPE_ITEM]:
+    # closed with the workers if the consumer stops early, the workers being
+    # killed as soon as `stopped` is set
+    with closing(extract_files(files, stopped=stopped)) as results:
+        for _, file_hash, pages in results:
+            if pages is None:  # failed, not indexed
+                continue
+            for chunk in document_to_chunks(pages):
+                yield file_hash, chunk
+            yield file_hash, None
+
+
+def prefetch(
+    iterator: Iterator, size: int, stopped: Optional[threading.Event] = None
+) -> Iterator:
+    # run the iterator in a thread so that reading the next files overlaps the
+    # encoding of the current batch. `stopped` is set when the consumer stops,
+    # normally or not : an iterator checking it does not delay the consumer
+    queue: Queue = Queue(maxsize=size)
+    end = object()
+    errors: List[BaseException] = []
+    stopped = stopped or threading.Event()
+
+    def put(e) -> bool:
+        # False if the consumer stopped meanwhile
+        while not stopped.is_set():
+            try:
+                queue.put(e, timeout=TIMEOUT_PUT_SECONDS)
+                return True
+            except Full:
+                continue
+        return False
+
+    def produce() -> None:
+        try:
+            for e in iterator:
+                if not put(e):
+                    break
+        except BaseException as error:
+            errors.append(error)
+        finally:
+            if hasattr(iterator, "close"):  # its workers, if a generator
+                iterator.close()
+            put(end)
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+
+    try:
+        while (e := queue.get()) is not end:
+            yield e
+    finally:
+        stopped.set()
+        producer.join()
+
+    if errors:
+        raise errors[0]
+
+
+def batched(iterator: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(iterator)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def ingest(
+    files: List[Tuple[Path, str]],
+    index: DocumentIndex,
+    retriever: SentenceTransformerWrapper,
+    batch_size: int = BATCH_SIZE,
+) -> None:
+    """Read, chunk and encode the (path, hash) files and add them to the index."""
+
+    if not files:
+        return
+
+    dim = retriever.model.get_sentence_embedding_dimension()
+
+    # chunks and embeddings of the files not yet complete
+    chunks: Dict[str, List[dict]] = {}
+    embeddings: Dict[str, List[np.ndarray]] = {}
+
+    progress = tqdm(total=len(files), desc="Indexing documents")
+    stopped = threading.Event()
+    chunks_read = prefetch(iter_chunks(files, stopped), PREFETCH_SIZE, stopped)
+    for batch in batched(chunks_read, batch_size):
+
+        # encode the chunks of the batch
+        items = [(file_hash, chunk) for file_hash, chunk in batch if chunk is not None]
+        if items:
+            batch_embeddings = retriever.encode([chunk["chunk"] for _, chunk in items])
+            for (file_hash, chunk), embedding in zip(items, batch_embeddings):
+                chunks.setdefault(file_hash, []).append(chunk)
+                embeddings.setdefault(file_hash, []).append(embedding)
+
+        # store the files ended in this batch
+        for file_hash, chunk in batch:
+            if chunk is not None:
+                continue
+
+            index.add(
+                file_hash,
+                pd.DataFrame(chunks.pop(file_hash, []), columns=COLUMNS_CHUNKS),
+                np.array(embeddings.pop(file_hash, []), dtype=np.float32).reshape(
+                    (-1, dim)
+                ),
+            )
+            progress.update(1)
+
+    progress.close()
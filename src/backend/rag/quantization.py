@@ -0,0 +1,93 @@
+from typing import Optional
+
+import numpy as np
+
+# bytes per dimension : 4, 2, 1 and 1/8
+ENCODINGS = ["float32", "float16", "int8", "binary"]
+
+# number of bits set in each byte, for the hamming distances
+POPCOUNT = np.array([bin(byte).count("1") for byte in range(256)], dtype=np.int32)
+
+NB_SAMPLES_PCA = 50_000
+# codes converted to float32 at once when scored
+BLOCK_SIZE_SCORE = 65_536
+
+
+class Quantizer:
+    """
+    Compact codes of normalized embeddings, scored against a query as an
+    approximation of the cosine similarity : float16, int8 with a scale per
+    dimension, or 1 bit per dimension (sign) scored by hamming distance. An
+    optional PCA projects the vectors on fewer dimensions first.
+    """
+
+    def __init__(self, encoding: str = "float32", pca_dims: Optional[int] = None):
+        if encoding not in ENCODINGS:
+            raise ValueError(f"Encoding '{encoding}' not in {ENCODINGS}")
+        self.encoding = encoding
+        self.pca_dims = pca_dims
+
+        self.mean: Optional[np.ndarray] = None
+        self.components: Optional[np.ndarray] = None
+        self.scales: Optional[np.ndarray] = None
+
+    def fit(self, vectors: np.ndarray, seed: int = 0) -> "Quantizer":
+
+        # 1. pca on a sample
+        if self.pca_dims is not None and self.pca_dims < vectors.shape[1]:
+            rng = np.random.default_rng(seed)
+            sample = vectors[
+                rng.choice(
+                    len(vectors), min(len(vectors), NB_SAMPLES_PCA), replace=False
+                )
+            ]
+            self.mean = sample.mean(axis=0)
+            _, _, vt = np.linalg.svd(sample - self.mean, full_matrices=False)
+            self.components = vt[: self.pca_dims].T.astype(np.float32)
+
+        # 2. int8 scale of each dimension
+        if self.encoding == "int8":
+            max_abs = np.abs(self.project(vectors)).max(axis=0)
+            self.scales = (np.maximum(max_abs, 1e-12) / 127).astype(np.float32)
+
+        return self
+
+    def project(self, vectors: np.ndarray) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.components is None:
+            return vectors
+        return (vectors - self.mean) @ self.components
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        projected = self.project(vectors)
+        if self.encoding == "float16":
+            return projected.astype(np.float16)
+        if self.encoding == "int8":
+            return np.clip(np.round(projected / self.scales), -127, 127).astype(np.int8)
+        if self.encoding == "binary":
+            return np.packbits(projected > 0, axis=-1)
+        return projected
+
+    def prepare_query(self, query: np.ndarray) -> np.ndarray:
+        # the query in the space of the codes
+        projected = self.project(query)
+        if self.encoding == "int8":
+            return projected * self.scales
+        if self.encoding == "binary":
+            return np.packbits(projected > 0, axis=-1)
+        return projected
+
+    def score(self, codes: np.ndarray, query_prepared: np.ndarray) -> np.ndarray:
+        """Approximate similarities, higher is nearer."""
+
+        if self.encoding == "binary":
+            hamming = POPCOUNT[np.bitwise_xor(codes, query_prepared)].sum(axis=1)
+            return -hamming.astype(np.float32)
+        return np.concatenate(
+            [
+                codes[start : start + BLOCK_SIZE_SCORE].astype(np.float32, copy=False)
+                @ query_prepared
+                for start in range(0, len(codes), BLOCK_SIZE_SCORE)
+            ]
+            or [np.zeros(0, dtype=np.float32)]
+        )
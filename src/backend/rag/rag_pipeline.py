@@ -1,13 +1,15 @@
 import os
 from abc import abstractmethod
 from datetime import datetime
-from typing import Callable, List
+from typing import Callable, List, Optional
 
 import numpy as np
 import pandas as pd
 
+from backend.rag.answer_cache import AnswerCache, get_question_embeddings
 from backend.rag.claude_client import ClaudeClient
-from backend.rag.retriever import SentenceTransformerWrapper
+from backend.rag.retrieval import pin_threads, search
+from backend.rag.retriever import SentenceTransformerWrapper, get_encoder
 from frontend.filters import Filters
 from vars import PATH_MODEL_MINI
 
@@ -15,12 +17,22 @@ from vars import PATH_MODEL_MINI
 class RagPipeline:
 
     def __init__(self):
-        # retriever
-        self.retriever = SentenceTransformerWrapper(PATH_MODEL_MINI)
+        pin_threads()
+
+        # retriever and questions already encoded : shared by the sessions, the
+        # retriever being loaded at the first question
+        self.question_embeddings = get_question_embeddings(PATH_MODEL_MINI)
+
+        # answers already given, on the same chunks
+        self.answer_cache = AnswerCache()
 
         # init LLM
         self.llm = ClaudeClient(os.environ["CLAUDE_KEY"])
 
+    @property
+    def retriever(self) -> SentenceTransformerWrapper:
+        return get_encoder(PATH_MODEL_MINI)
+
     @abstractmethod
     def format_chunks(self, df: pd.DataFrame) -> List[str]:
         pass
@@ -38,28 +50,45 @@ class RagPipeline:
         question: str,
         df: pd.DataFrame,
         embeddings: np.ndarray,
+        filters_key: Optional[str] = None,
     ) -> str:
 
         # check consistency
         assert len(df) == embeddings.shape[0]
 
         # compute question embeddings
-        question_embeddings = self.retriever.encode(question)
+        question_embeddings = self.encode_question(question)
 
-        # compute similarity
-        similarities = self.retriever.similarity(embeddings, question_embeddings)
-        assert similarities.shape == (len(df), 1)
+        # n top chunks, the dataframe left untouched
+        ids, similarities = search(embeddings, question_embeddings, self.get_n())
+        df_top = df.iloc[ids].assign(similarity=similarities)
+        print(df_top)
 
-        # join it with all the data
-        df["similarity"] = similarities.reshape((len(df),))
-        df.sort_values("similarity", ascending=False, inplace=True)
+        return self._answer(question, df_top, filters_key, question_embeddings)
 
-        # keep n top chunks
-        print(df)
-        df = df.iloc[: self.get_n()]
+    def encode_question(self, question: str) -> np.ndarray:
+        return self.question_embeddings.get(question)
+
+    def _answer(
+        self,
+        question: str,
+        df: pd.DataFrame,
+        filters_key: Optional[str] = None,
+        question_embedding: Optional[np.ndarray] = None,
+    ) -> str:
+        # df : the top chunks, best first
 
         # format chunks
         contexts = self.format_chunks(df)
+        instructions = self.get_instructions()
+
+        # answered before
+        args_cache = question, filters_key, contexts, instructions, question_embedding
+        answer = self.answer_cache.get(*args_cache)
+        if answer is not None:
+            print("-----------------\nResult (cache)\n\n")
+            print(answer)
+            return answer
 
         # ask the llm
         m = f"""Utilisez les informations suivantes :
@@ -69,7 +98,7 @@ class RagPipeline:
             {question}
 
             Ne pas inclure tout ce qui ne semble pas pertinent.
-            {'\n'.join(self.get_instructions())}.
+            {'\n'.join(instructions)}.
         """
         print(m)
 
@@ -81,6 +110,7 @@ class RagPipeline:
 
         print("-----------------\nResult\n\n")
         print(answer)
+        self.answer_cache.add(*args_cache, answer)
 
         return answer
 
@@ -0,0 +1,64 @@
+from typing import Optional, Tuple
+
+import numpy as np
+import torch
+
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:  # the blas threads are then left as they are
+    threadpool_limits = None
+
+# threads of the blas and torch computations, per process
+NB_THREADS = 4
+
+
+def pin_threads(nb_threads: int = NB_THREADS) -> None:
+    torch.set_num_threads(nb_threads)
+    if threadpool_limits is not None:
+        threadpool_limits(limits=nb_threads, user_api="blas")
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    # positions of the k best scores, best first
+    if k < len(scores):
+        positions = np.argpartition(-scores, k)[:k]
+    else:
+        positions = np.arange(len(scores))
+    return positions[np.argsort(-scores[positions], kind="stable")]
+
+
+def search(
+    embeddings: np.ndarray,
+    query: np.ndarray,
+    k: int,
+    rows: Optional[np.ndarray] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Row ids and cosine similarities of the k rows of embeddings nearest to the
+    query, best first, among the rows if given. Only the scores are sorted,
+    partially : the caller looks up the k rows it needs.
+    """
+
+    query = normalize(query).reshape(-1)
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+
+    # 1. scores of the selected rows
+    if rows is None:
+        vectors = embeddings
+    else:
+        rows = np.asarray(rows, dtype=np.int64)
+        vectors = embeddings[rows]
+    norms = np.linalg.norm(vectors, axis=1)
+    scores = (vectors @ query) / np.maximum(norms, 1e-12)
+
+    # 2. k best
+    best = top_k(scores, k)
+    ids = best if rows is None else rows[best]
+
+    return ids, scores[best]
@@ -1,33 +1,195 @@
+import threading
+import time
 from pathlib import Path
+from typing import Dict, List
 
+import numpy as np
 import torch
 from sentence_transformers import SentenceTransformer
 
 from helper import cache
+from vars import PATH_MODEL_MINI
+
+# torch, or onnx runtime on cpu with the weights in float32 or quantized to
+# int8 (dynamic quantization). The onnx backends need sentence-transformers[onnx].
+ENCODER_BACKENDS = ["torch", "onnx", "onnx-int8"]
+ENCODER_BACKEND = "torch"
+
+# int8 kernels of the cpus of the servers
+QUANTIZATION_CONFIG = "avx2"
+FILE_ONNX = "onnx/model.onnx"
+FILE_ONNX_INT8 = f"onnx/model_qint8_{QUANTIZATION_CONFIG}.onnx"
+
+# parity of an onnx backend with torch, checked when exported
+TEXTS_PARITY = [
+    "Quelles sont les aléas survenus ?",
+    "Le lot 2 a pris du retard sur la livraison des menuiseries.",
+    "Réunion de chantier : présents l'architecte, le maître d'ouvrage et les entreprises.",
+    "Reprise des enduits de façade prévue semaine prochaine, sous réserve de la météo.",
+]
+COSINE_MIN_PARITY = {"onnx": 0.9999, "onnx-int8": 0.98}
+
+# encoders loaded in this process, by model path and backend
+_encoders: Dict[str, "SentenceTransformerWrapper"] = {}
+_lock_encoders = threading.Lock()
+
+
+def _file_onnx(backend: str) -> str:
+    return FILE_ONNX_INT8 if backend == "onnx-int8" else FILE_ONNX
+
+
+def export_onnx(path_model: Path, backend: str = "onnx-int8") -> Path:
+    """
+    Export the local torch model to onnx next to its weights, quantized if
+    asked, once. Return the path of the onnx file.
+    """
+
+    from sentence_transformers import export_dynamic_quantized_onnx_model
+
+    path_model = Path(path_model)
+    path_onnx = path_model / _file_onnx(backend)
+    if path_onnx.exists():
+        return path_onnx
+
+    # 1. float32 export (saved in the onnx sub-folder)
+    if not (path_model / FILE_ONNX).exists():
+        print(f"Exporting {path_model.name} to onnx...")
+        model = SentenceTransformer(str(path_model), backend="onnx")
+        model.transformers_model.save_pretrained(str(path_model))
+
+    # 2. int8 weights
+    if backend == "onnx-int8":
+        print(f"Quantizing {path_model.name}...")
+        model = SentenceTransformer(
+            str(path_model), backend="onnx", model_kwargs={"file_name": FILE_ONNX}
+        )
+        export_dynamic_quantized_onnx_model(model, QUANTIZATION_CONFIG, str(path_model))
+
+    # 3. same embeddings as torch, else not kept
+    cosine_min = check_parity(path_model, backend)
+    if cosine_min < COSINE_MIN_PARITY[backend]:
+        path_onnx.unlink()
+        raise ValueError(
+            f"Backend '{backend}' differs from torch : cosine {cosine_min:.4f} < {COSINE_MIN_PARITY[backend]}"
+        )
+
+    return path_onnx
+
+
+def _load_model(
+    path_model: Path, backend: str, export: bool = True
+) -> SentenceTransformer:
+    if backend not in ENCODER_BACKENDS:
+        raise ValueError(f"Backend '{backend}' not in {ENCODER_BACKENDS}")
+    if backend == "torch":
+        return SentenceTransformer(str(path_model))
+
+    if export:
+        with cache.lock(str(Path(path_model) / _file_onnx(backend))):  # one export
+            export_onnx(path_model, backend)
+    return SentenceTransformer(
+        str(path_model),
+        backend="onnx",
+        model_kwargs={"file_name": _file_onnx(backend)},
+    )
 
 
 class SentenceTransformerWrapper:
-    def __init__(self, path_model: Path):
-        self.model = SentenceTransformer(str(path_model))
-        self.encode = self.model.encode
+    def __init__(self, path_model: Path, backend: str = ENCODER_BACKEND):
+        start = time.perf_counter()
+        self.backend = backend
+        self.model = _load_model(path_model, backend)
         self.similarity = self.model.similarity
 
+        # one encode at a time : the tokenizer is not thread-safe
+        self.lock = threading.Lock()
+
+        self.load_seconds = time.perf_counter() - start
+        if backend == "torch":
+            self.nb_bytes = sum(
+                tensor.numel() * tensor.element_size()
+                for tensor in [*self.model.parameters(), *self.model.buffers()]
+            )
+        else:
+            self.nb_bytes = (Path(path_model) / _file_onnx(backend)).stat().st_size
+
+    def encode(self, *args, **kwargs):
+        with self.lock:
+            return self.model.encode(*args, **kwargs)
+
     @staticmethod
     def save(embeddings: torch.Tensor, filename: str) -> None:
-        assert filename.endswith(".pt")
+        assert filename.endswith(".pt") or filename.endswith(".npy")
+        if filename.endswith(".npy"):
+            embeddings = np.asarray(embeddings, dtype=np.float32)
         cache.save(filename, embeddings)
 
     @staticmethod
     def load_embeddings(filename: str) -> torch.Tensor:
+        # .npy : memory-mapped, read-only
         return cache.load(filename)
 
 
-if __name__ == "__main__":
+def get_encoder(
+    path_model: Path = PATH_MODEL_MINI, backend: str = ENCODER_BACKEND
+) -> SentenceTransformerWrapper:
+    """Encoder shared by the whole process (sessions, pipelines), loaded on first use."""
+
+    key = f"{path_model} ({backend})"
+    with _lock_encoders:
+        if key not in _encoders:
+            encoder = SentenceTransformerWrapper(path_model, backend)
+            print(
+                f"Loaded encoder {Path(path_model).name} ({backend}) in "
+                f"{encoder.load_seconds:.1f}s ({encoder.nb_bytes / 1024**2:.0f} MB)"
+            )
+            _encoders[key] = encoder
+        return _encoders[key]
+
+
+def check_parity(
+    path_model: Path = PATH_MODEL_MINI,
+    backend: str = "onnx-int8",
+    texts: List[str] = TEXTS_PARITY,
+    nb_repeats: int = 5,
+) -> float:
+    """
+    Minimum cosine between the embeddings of the texts by torch and by the
+    backend, printed with the encoding times of both.
+    """
+
+    embeddings, seconds = {}, {}
+    for name in ["torch", backend]:
+        model = _load_model(path_model, name, export=False)
+        model.encode(texts)  # warm-up
+        start = time.perf_counter()
+        for _ in range(nb_repeats):
+            embeddings[name] = model.encode(texts, normalize_embeddings=True)
+        seconds[name] = (time.perf_counter() - start) / nb_repeats
+
+    cosine_min = float(
+        np.min(np.sum(embeddings["torch"] * embeddings[backend], axis=1))
+    )
+    print(
+        f"Parity {backend} : cosine min {cosine_min:.5f} ; "
+        f"{seconds['torch'] * 1e3:.1f}ms (torch) -> {seconds[backend] * 1e3:.1f}ms"
+    )
+
+    return cosine_min
+
+
+def get_stats() -> dict:
+    return {
+        key: dict(load_seconds=encoder.load_seconds, nb_bytes=encoder.nb_bytes)
+        for key, encoder in _encoders.items()
+    }
+
+
+def encode_sample(backend: str = ENCODER_BACKEND) -> None:
     from backend.saint_amand.extract_all_infos import (
         filter_compressed,
         load_df_compressed,
     )
-    from vars import PATH_MODEL_MINI
 
     # load data
     print("Loading data...")
@@ -36,7 +198,7 @@ if __name__ == "__main__":
 
     # load retriever
     print("Loading retriever...")
-    retriever = SentenceTransformerWrapper(PATH_MODEL_MINI)
+    retriever = get_encoder(backend=backend)
 
     # encode
     print("Encoding...")
@@ -45,3 +207,9 @@ if __name__ == "__main__":
     # saving
     print("Saving...")
     retriever.save(embeddings, "test.pt")
+
+
+if __name__ == "__main__":
+    import fire
+
+    fire.Fire({"encode": encode_sample, "export": export_onnx, "parity": check_parity})
@@ -1,61 +1,132 @@
 from datetime import datetime
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 
 import numpy as np
 import pandas as pd
 
+from backend.rag.ann_index import AnnIndex
 from backend.rag.rag_pipeline import RagPipeline
-from backend.rag.retriever import SentenceTransformerWrapper
+from backend.rag.retriever import (
+    ENCODER_BACKEND,
+    SentenceTransformerWrapper,
+    get_encoder,
+)
 from backend.saint_amand.extract_all_infos import (
     convert_filters_to_args,
     filter_compressed,
     load_df_compressed,
+    save_infos,
 )
+from backend.saint_amand.filter_index import FilterIndex
 from frontend.filters import Filters
+from helper import cache
 from vars import PATH_MODEL_MINI
 
-FILENAME_EMBEDDINGS = "embeddings_saint_amand.pt"
+# memory-mapped : the sessions share the pages of the file. One file per
+# encoder backend, their embeddings are not interchangeable
+FILENAME_EMBEDDINGS = f"embeddings_saint_amand_{ENCODER_BACKEND}.npy"
+FILENAME_EMBEDDINGS_LEGACY = "embeddings_saint_amand.pt"  # torch only
+# the infos and their embeddings are written and read together under this lock
+FILENAME_LOCK_DATA = "data_saint_amand"
 
+# codes of the ann index, rescored exactly on the embeddings (see Quantizer),
+# chosen on the recall measured by ann_index.check_recall
+ENCODING_SAINT_AMAND = "int8"
+PCA_DIMS_SAINT_AMAND: Optional[int] = None
 
-def load_data_retriever() -> pd.DataFrame:
-    print("Loading data...")
-    df = load_df_compressed()
-    df = filter_compressed(
-        df,
+
+def select_data_retriever(df_compressed: pd.DataFrame) -> pd.DataFrame:
+    return filter_compressed(
+        df_compressed,
         projects_to_extract=None,  # projects_to_extract=["Lot 2 ", "Lot 14 "], cr_num_bounds=(1, 10)
     )
 
-    return df
 
+def load_data_retriever() -> pd.DataFrame:
+    print("Loading data...")
+    return select_data_retriever(load_df_compressed())
 
-def numerize_data() -> None:
 
-    # load data
-    df = load_data_retriever()
+def compute_numerization(
+    df: pd.DataFrame, previous: Optional[Tuple[List[str], np.ndarray]] = None
+) -> np.ndarray:
+
+    # reuse the embeddings of the cells already encoded
+    embedding_by_cell = (
+        dict(zip(*previous)) if previous and previous[1] is not None else {}
+    )
+    cells_to_encode = [
+        cell for cell in dict.fromkeys(df["cell"]) if cell not in embedding_by_cell
+    ]
 
     # load retriever
     print("Loading retriever...")
-    retriever = SentenceTransformerWrapper(PATH_MODEL_MINI)
+    retriever = get_encoder(PATH_MODEL_MINI)
 
     # encode
-    print("Encoding...")
-    embeddings = retriever.encode(df["cell"].tolist(), show_progress_bar=True)
+    print(f"Encoding {len(cells_to_encode)} cells...")
+    if cells_to_encode:
+        embedding_by_cell.update(
+            zip(
+                cells_to_encode,
+                retriever.encode(cells_to_encode, show_progress_bar=True),
+            )
+        )
+    return np.stack([embedding_by_cell[cell] for cell in df["cell"]])
+
+
+def numerize_data(previous: Optional[Tuple[List[str], np.ndarray]] = None) -> None:
+    embeddings = compute_numerization(load_data_retriever(), previous)
 
     # saving
     print("Saving...")
-    retriever.save(embeddings, FILENAME_EMBEDDINGS)
+    with cache.lock(FILENAME_LOCK_DATA):
+        SentenceTransformerWrapper.save(embeddings, FILENAME_EMBEDDINGS)
+
+
+def publish_data(
+    df_cr: pd.DataFrame,
+    df_tables: pd.DataFrame,
+    df_compressed: pd.DataFrame,
+    embeddings: np.ndarray,
+) -> None:
+    # a reader never sees the new cells with the old embeddings
+    with cache.lock(FILENAME_LOCK_DATA):
+        save_infos(df_cr, df_tables, df_compressed)
+        SentenceTransformerWrapper.save(embeddings, FILENAME_EMBEDDINGS)
+
+
+def load_data() -> Tuple[pd.DataFrame, np.ndarray]:
+    with cache.lock(FILENAME_LOCK_DATA):
+        df, embeddings = load_data_retriever(), load_numerization()
+        if embeddings is None:  # not encoded yet with this backend
+            SentenceTransformerWrapper.save(
+                compute_numerization(df), FILENAME_EMBEDDINGS
+            )
+            embeddings = load_numerization()
+        return df, embeddings
 
 
-def load_numerization() -> np.ndarray:
+def load_numerization() -> Optional[np.ndarray]:
     print("Load numerization...")
+    if not cache.exists(FILENAME_EMBEDDINGS):  # saved before the .npy format
+        if ENCODER_BACKEND != "torch":
+            return None
+        embeddings = cache.load(FILENAME_EMBEDDINGS_LEGACY)
+        if embeddings is None:
+            return None
+        SentenceTransformerWrapper.save(embeddings, FILENAME_EMBEDDINGS)
     return SentenceTransformerWrapper.load_embeddings(filename=FILENAME_EMBEDDINGS)
 
 
 class RagSaintAmand(RagPipeline):
     def __init__(self):
         super().__init__()
-        self.df = load_data_retriever()
-        self.embeddings = load_numerization()
+        self.df, self.embeddings = load_data()
+        self.filter_index = FilterIndex(self.df)
+        self.ann_index = AnnIndex.load_or_build(
+            self.embeddings, ENCODING_SAINT_AMAND, PCA_DIMS_SAINT_AMAND
+        )
 
         assert len(self.df) == self.embeddings.shape[0]
 
@@ -77,19 +148,21 @@ class RagSaintAmand(RagPipeline):
     def get_n(self) -> int:
         return 10
 
-    def ask(self, question: str, filters: Filters) -> Tuple[pd.DataFrame, np.ndarray]:
+    def ask(self, question: str, filters: Filters) -> str:
 
-        # filter data
-        print(f"Len before : {len(self.df)}")
-        df = self.df.copy()
-        df.index = range(len(df))
-        df = filter_compressed(df, **convert_filters_to_args(filters))
-        print(f"Len after : {len(df)}")
+        # rows allowed by the filters
+        rows = self.filter_index.select(**convert_filters_to_args(filters))
+        print(f"Len before : {len(self.df)} ; Len after : {len(rows)}")
 
-        # filter embeddings
-        embeddings = self.embeddings[df.index]
+        # nearest allowed cells
+        question_embeddings = self.encode_question(question)
+        ids, similarities = self.ann_index.search(
+            question_embeddings, self.get_n(), allowed=rows
+        )
+        df = self.df.iloc[ids].assign(similarity=similarities)
+        print(df)
 
-        return super()._ask(question, df, embeddings)
+        return self._answer(question, df, str(filters), question_embeddings)
 
 
 if __name__ == "__main__":
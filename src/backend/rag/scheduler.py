@@ -0,0 +1,172 @@
+import multiprocessing
+import os
+import signal
+import threading
+import time
+from multiprocessing.connection import Connection, wait
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import pymupdf
+
+from backend.read_file import file_to_text
+
+# a file still extracting after this delay is killed
+TIMEOUT_FILE_SECONDS = 10 * 60
+
+# above this number of bytes per page, a pdf is probably scanned and OCRed
+SCANNED_BYTES_PER_PAGE = 100_000
+# an OCRed page costs roughly as much as this many bytes of native text
+OCR_COST_FACTOR = 50
+
+# under this total cost (small uploads, the common case), the files are extracted
+# in the calling process : starting the workers would cost more
+MAX_COST_IN_PROCESS = 5 * 1024**2
+
+# the pool checks this often whether its consumer stopped
+TIMEOUT_POLL_SECONDS = 0.1
+
+# tesseract processes of each worker : the workers already use all the cpus
+MAX_WORKERS_OCR = 1
+
+# (path, hash, pages or None if the extraction failed)
+TYPE_RESULT = Tuple[Path, str, Optional[List[dict]]]
+
+
+def estimate_cost(path_file: Path) -> float:
+    size = os.path.getsize(path_file)
+    if path_file.suffix != ".pdf":
+        return size
+
+    try:
+        with pymupdf.open(path_file) as doc:
+            nb_pages = max(len(doc), 1)
+    except Exception:
+        return size
+
+    return size * OCR_COST_FACTOR if size / nb_pages > SCANNED_BYTES_PER_PAGE else size
+
+
+def _work(connection: Connection) -> None:
+    # own process group : killed with its ocr processes
+    if hasattr(os, "setpgrp"):
+        os.setpgrp()
+
+    # extract the files received until None
+    while (path_file := connection.recv()) is not None:
+        try:
+            pages = list(file_to_text(path_file, max_workers_ocr=MAX_WORKERS_OCR))
+            connection.send(("ok", pages))
+        except Exception as e:
+            connection.send(("error", f"{type(e).__name__}: {e}"))
+
+
+def _start_worker(context) -> Tuple[multiprocessing.Process, Connection]:
+    connection, connection_worker = context.Pipe()
+    # not daemonic : the ocr of a worker uses its own process pool
+    process = context.Process(target=_work, args=(connection_worker,))
+    process.start()
+    connection_worker.close()
+    return process, connection
+
+
+def extract_files(
+    files: List[Tuple[Path, str]],
+    max_workers: Optional[int] = None,
+    timeout: float = TIMEOUT_FILE_SECONDS,
+    stopped: Optional[threading.Event] = None,
+) -> Iterator[TYPE_RESULT]:
+    """
+    Extract the pages of the (path, hash) files on a pool of worker processes,
+    the most expensive ones first, or in the calling process if they are cheap
+    (see MAX_COST_IN_PROCESS). Results are yielded in completion order. A
+    file that fails, crashes its worker or exceeds the timeout is yielded
+    with None pages and does not stop the others : a crashed or killed worker
+    is replaced. Once `stopped` is set, the extraction ends and the workers are
+    killed without waiting for their files.
+    """
+
+    def fail(path_file: Path, file_hash: str, reason: str) -> TYPE_RESULT:
+        print(f"Extraction of '{path_file}' failed : {reason}")
+        return path_file, file_hash, None
+
+    cost_by_path = {path_file: estimate_cost(path_file) for path_file, _ in files}
+
+    # 1. cheap files (txt, docx, pdfs with native text) : no worker
+    if sum(cost_by_path.values()) <= MAX_COST_IN_PROCESS:
+        for path_file, file_hash in files:
+            if stopped is not None and stopped.is_set():
+                return
+            try:
+                yield path_file, file_hash, list(file_to_text(path_file))
+            except Exception as e:
+                yield fail(path_file, file_hash, f"{type(e).__name__}: {e}")
+        return
+
+    # 2. pool of workers
+    max_workers = max_workers or os.cpu_count() or 1
+    # spawn : the caller may hold threads (encoding, streamlit) unsafe to fork
+    context = multiprocessing.get_context("spawn")
+
+    # the most expensive files last, to be popped first
+    pending = sorted(files, key=lambda file: cost_by_path[file[0]])
+
+    idle: List[Tuple[multiprocessing.Process, Connection]] = []
+    # connection -> (process, path, hash, deadline)
+    busy: Dict[Connection, Tuple[multiprocessing.Process, Path, str, float]] = {}
+
+    def stop(process: multiprocessing.Process, connection: Connection) -> None:
+        # the worker and its ocr pool, tesseract included
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except (AttributeError, ProcessLookupError, PermissionError):
+            process.kill()  # windows, or group not created yet
+        process.join()
+        connection.close()
+
+    try:
+        while pending or busy:
+            if stopped is not None and stopped.is_set():
+                return
+
+            # send the next files to the workers
+            while pending and len(busy) < max_workers:
+                process, connection = idle.pop() if idle else _start_worker(context)
+                path_file, file_hash = pending.pop()
+                connection.send(path_file)
+                busy[connection] = process, path_file, file_hash, time.time() + timeout
+
+            # wait for a result, the next deadline or the next check of `stopped`
+            next_deadline = min(deadline for *_, deadline in busy.values())
+            timeout_wait = max(next_deadline - time.time(), 0)
+            if stopped is not None:
+                timeout_wait = min(timeout_wait, TIMEOUT_POLL_SECONDS)
+            for connection in wait(list(busy), timeout=timeout_wait):
+                process, path_file, file_hash, _ = busy.pop(connection)
+                try:
+                    status, result = connection.recv()
+                    idle.append((process, connection))
+                except EOFError:  # the worker died without answering
+                    stop(process, connection)
+                    status = "error"
+                    result = f"worker exited with code {process.exitcode}"
+
+                if status == "ok":
+                    yield path_file, file_hash, result
+                else:
+                    yield fail(path_file, file_hash, result)
+
+            # kill the workers over time
+            now = time.time()
+            for connection in [c for c, (*_, end) in busy.items() if end <= now]:
+                process, path_file, file_hash, _ = busy.pop(connection)
+                stop(process, connection)
+                yield fail(path_file, file_hash, f"timeout after {timeout}s")
+
+    finally:
+        for process, connection in idle:
+            connection.send(None)
+            process.join()
+            connection.close()
+        for connection, (process, *_) in busy.items():
+            stop(process, connection)
@@ -0,0 +1,109 @@
+import zipfile
+from pathlib import Path
+from typing import Iterator, List
+from xml.etree.ElementTree import iterparse
+
+W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+SEPARATOR_CELLS = " | "
+
+
+def iter_docx_pages(path_docx: Path) -> Iterator[str]:
+    """
+    Stream the pages of a docx from its word/document.xml, paragraphs and
+    tables being kept in document order. Pages are split on explicit page
+    breaks and on the page breaks rendered by Word at the last save.
+    """
+
+    blocks: List[str] = []  # paragraphs and tables of the current page
+    paragraph: List[str] = []  # text of the current paragraph
+    tables: List[List[str]] = []  # rows of the opened tables (nested ones too)
+    rows: List[List[str]] = []  # cells of the opened rows
+    cells: List[List[str]] = []  # paragraphs of the opened cells
+
+    # a rendered break right after an explicit one marks the same new page
+    at_page_start = True
+    # w:tab is a character in a run (w:r), a tab stop in the paragraph properties
+    nb_runs_opened = 0
+
+    def end_paragraph() -> None:
+        text = "".join(paragraph)
+        paragraph.clear()
+        if cells:
+            cells[-1].append(text)
+        else:
+            blocks.append(text)
+
+    def end_page() -> str:
+        # the text before the break belongs to the ending page
+        if paragraph:
+            end_paragraph()
+        page = "\n".join(blocks)
+        blocks.clear()
+        return page
+
+    with zipfile.ZipFile(path_docx) as zf, zf.open("word/document.xml") as fr:
+        body = None
+        for event, elem in iterparse(fr, events=("start", "end")):
+            tag = elem.tag
+
+            if event == "start":
+                if tag == W + "body":
+                    body = elem
+                elif tag == W + "tbl":
+                    tables.append([])
+                elif tag == W + "tr":
+                    rows.append([])
+                elif tag == W + "tc":
+                    cells.append([])
+                elif tag == W + "r":
+                    nb_runs_opened += 1
+                elif tag == W + "lastRenderedPageBreak" and not tables:
+                    if not at_page_start:
+                        yield end_page()
+                        at_page_start = True
+                continue
+
+            # end events
+            if tag == W + "t":
+                if elem.text:
+                    paragraph.append(elem.text)
+                    at_page_start = False
+            elif tag == W + "tab":
+                if nb_runs_opened:
+                    paragraph.append("\t")
+            elif tag == W + "r":
+                nb_runs_opened -= 1
+            elif tag in (W + "br", W + "cr"):
+                if elem.get(W + "type") == "page" and not tables:
+                    yield end_page()
+                    at_page_start = True
+                else:
+                    paragraph.append("\n")
+            elif tag == W + "pageBreakBefore" and not tables:
+                if elem.get(W + "val") not in ("0", "false") and not at_page_start:
+                    yield end_page()
+                    at_page_start = True
+            elif tag == W + "p":
+                end_paragraph()
+            elif tag == W + "tc":
+                rows[-1].append("\n".join(cells.pop()).strip())
+            elif tag == W + "tr":
+                tables[-1].append(SEPARATOR_CELLS.join(rows.pop()))
+            elif tag == W + "tbl":
+                text = "\n".join(tables.pop())
+                if cells:
+                    cells[-1].append(text)
+                else:
+                    blocks.append(text)
+
+            # free the processed top-level paragraphs and tables
+            if tag in (W + "p", W + "tbl") and not tables and body is not None:
+                body.clear()
+
+    if blocks or paragraph:
+        yield end_page()
+
+
+def read_docx_by_page(path_docx: Path) -> List[str]:
+    return list(iter_docx_pages(path_docx))
@@ -0,0 +1,23 @@
+from pathlib import Path
+from typing import Iterator, Optional
+
+from backend.read_docx import iter_docx_pages
+from backend.read_pdf_mixed import read_pdf_mixed
+
+
+def file_to_text(
+    path_file: Path, max_workers_ocr: Optional[int] = None
+) -> Iterator[dict]:
+    # yield the pages of the file one by one
+    if path_file.suffix == ".txt":
+        with open(path_file, "r") as fr:
+            text = fr.read()
+        yield {"pathfile": path_file, "text": text, "page": None}
+    elif path_file.suffix == ".docx":
+        for page, text in enumerate(iter_docx_pages(path_file), start=1):
+            yield {"pathfile": path_file, "text": text, "page": page}
+    elif path_file.suffix == ".pdf":
+        for e in read_pdf_mixed(path_file, max_workers=max_workers_ocr):
+            yield {"pathfile": path_file, "text": e.text, "page": e.page}
+    else:
+        print(f"Extension '{path_file.suffix}' not handled.")
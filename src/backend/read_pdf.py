@@ -1,37 +1,161 @@
+import hashlib
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
 
 import pymupdf
 from tqdm import tqdm
 
 from helper import cache
 
+# number of pages handled by one worker task
+PAGES_PER_TASK = 32
+# under this number of pages to extract, the process pool is not worth it
+MIN_PAGES_POOL = 2 * PAGES_PER_TASK
 
-def read_pdf(path_pdf: Path, pages: Optional[List[int]] = None) -> List[str]:
+# text of each page of all the pdfs, one evictable file per page key
+FOLDER_TEXT_PAGES = "text_pages"
 
-    filename_cache = path_pdf.stem + "_text_pages.json"
+PATTERN_REF = r"(\d+) \d+ R"
+PATTERN_PARENT = r"/Parent \d+ \d+ R"
+# links of the annotations (/Dest, /P) lead to other pages, not drawn by the page
+PATTERN_ANNOTS = r"/Annots\s*(\[[^\]]*\]|\d+ \d+ R)"
 
-    # load from cache
-    if text_pages := cache.load(filename_cache):
-        print(f"Load '{path_pdf}' from cache")
-        return text_pages
+
+def _read_xref(doc: pymupdf.Document, xref: int) -> Tuple[List[int], str]:
+    # objects referenced by the object, not the page tree above it nor the
+    # annotations, and digest of its source and raw stream
+    source = doc.xref_object(xref, compressed=True)
+    sha = hashlib.sha1(source.encode())
+    if doc.xref_is_stream(xref):
+        sha.update(doc.xref_stream_raw(xref))
+
+    source = re.sub(PATTERN_ANNOTS, "", re.sub(PATTERN_PARENT, "", source))
+    return [int(ref) for ref in re.findall(PATTERN_REF, source)], sha.hexdigest()
+
+
+def _inherited_resources(doc: pymupdf.Document, xref: int) -> str:
+    # resources of the page or of its nearest ancestor
+    while True:
+        kind, value = doc.xref_get_key(xref, "Resources")
+        if kind != "null":
+            return value
+        kind, value = doc.xref_get_key(xref, "Parent")
+        if kind != "xref":
+            return ""
+        xref = int(value.split()[0])
+
+
+def _compute_page_keys(doc: pymupdf.Document, pages: List[int]) -> Dict[int, str]:
+    """
+    Hash of everything each page draws (contents, resources, xobjects, fonts,
+    ...) : the same content stream ("/Im0 Do") with other images or forms gets
+    another key, an edited page gets a new key, and pages appended to a document
+    do not invalidate the ones already extracted. Each object is read and hashed
+    once for the document, the objects shared by the pages (fonts, logos) too.
+    """
+
+    xref_length = doc.xref_length()
+    xref_infos: Dict[int, Tuple[List[int], str]] = {}
+
+    def get_infos(xref: int) -> Tuple[List[int], str]:
+        if xref not in xref_infos:
+            xref_infos[xref] = _read_xref(doc, xref)
+        return xref_infos[xref]
+
+    page_keys = {}
+    for page in pages:
+        xref_page = doc[page - 1].xref
+        resources = _inherited_resources(doc, xref_page)
+
+        # 1. objects reachable from the page and from its (inherited) resources
+        seen = set()
+        stack = [xref_page] + [int(ref) for ref in re.findall(PATTERN_REF, resources)]
+        while stack:
+            xref = stack.pop()
+            if xref in seen or not 0 < xref < xref_length:
+                continue
+            seen.add(xref)
+            stack.extend(get_infos(xref)[0])
+
+        # 2. key from their digests
+        sha = hashlib.sha1(resources.encode())
+        for xref in sorted(seen):
+            sha.update(get_infos(xref)[1].encode())
+        page_keys[page] = sha.hexdigest()
+
+    return page_keys
+
+
+def _extract_pages(path_pdf: Path, pages: List[int]) -> Dict[int, str]:
+    with pymupdf.open(path_pdf) as doc:
+        return {page: doc[page - 1].get_text() for page in pages}
+
+
+def _split_into_tasks(pages: List[int]) -> List[List[int]]:
+    return [
+        pages[idx : idx + PAGES_PER_TASK]
+        for idx in range(0, len(pages), PAGES_PER_TASK)
+    ]
+
+
+def read_pdf(
+    path_pdf: Path, pages: Optional[List[int]] = None, max_workers: Optional[int] = None
+) -> List[str]:
 
     # open doc
     with pymupdf.open(path_pdf) as doc:
+        pages = list(pages) if pages else list(range(1, len(doc) + 1))
+        page_keys = _compute_page_keys(doc, pages)
+
+    # load from cache
+    text_by_key: Dict[str, str] = {}
+    for key in dict.fromkeys(page_keys.values()):
+        text = cache.load(f"{FOLDER_TEXT_PAGES}/{key}.json")
+        if text is not None:
+            text_by_key[key] = text
+
+    pages_to_read = [page for page in pages if page_keys[page] not in text_by_key]
+    if not pages_to_read:
+        print(f"Load '{path_pdf}' from cache")
+        return [text_by_key[page_keys[page]] for page in pages]
+
+    print(
+        f"Load {len(pages) - len(pages_to_read)}/{len(pages)} pages of '{path_pdf}' from cache"
+    )
+
+    # extract the missing pages, saving after each task so that a crash does not
+    # lose the pages already read
+    tasks = _split_into_tasks(pages_to_read)
+    progress = tqdm(total=len(pages_to_read), desc=f"Reading pdf : '{path_pdf}'")
 
-        # filters pages
-        text_pages_to_read = [doc[page - 1] for page in pages] if pages else doc
+    def store(texts: Dict[int, str]) -> None:
+        for page, text in texts.items():
+            text_by_key[page_keys[page]] = text
+            cache.save(f"{FOLDER_TEXT_PAGES}/{page_keys[page]}.json", text)
+        progress.update(len(texts))
 
-        # get pages
-        text_pages = [
-            page.get_text()
-            for page in tqdm(text_pages_to_read, desc=f"Reading pdf : '{path_pdf}'")
-        ]
+    if len(pages_to_read) < MIN_PAGES_POOL:
+        for task in tasks:
+            store(_extract_pages(path_pdf, task))
+    else:
+        max_workers = max_workers or min(os.cpu_count() or 1, len(tasks))
+        # spawn : read_pdf runs in the threads of the pipeline and of the server
+        with ProcessPoolExecutor(
+            max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")
+        ) as executor:
+            futures = [
+                executor.submit(_extract_pages, path_pdf, task) for task in tasks
+            ]
+            for future in as_completed(futures):
+                store(future.result())
 
-    # save in cache
-    cache.save(filename_cache, text_pages)
+    progress.close()
 
-    return text_pages
+    return [text_by_key[page_keys[page]] for page in pages]
 
 
 if __name__ == "__main__":
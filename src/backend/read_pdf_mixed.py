@@ -0,0 +1,124 @@
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import pymupdf
+from PIL import Image
+from tqdm import tqdm
+
+from backend.ocr import ocr_images
+
+# under this number of characters, a page is considered as image-only
+MIN_CHARS_TEXT_PAGE = 20
+
+METHOD_TEXT = "text"
+METHOD_OCR = "ocr"
+# ocr failed : the native text is kept, even if (almost) empty
+METHOD_FAILED = "failed"
+
+
+@dataclass
+class PageExtraction:
+    page: int
+    text: str
+    method: str
+    seconds: float
+
+
+def read_pdf_mixed(
+    path_pdf: Path,
+    language: str = "eng",
+    dpi: int = 300,
+    max_workers: Optional[int] = None,
+) -> List[PageExtraction]:
+    # max_workers : tesseract processes, the number of cpus by default
+
+    extractions: Dict[int, PageExtraction] = {}
+
+    # open doc once for both paths
+    with pymupdf.open(path_pdf) as doc:
+
+        # 1. native text where it exists
+        pages_to_ocr: List[int] = []
+        native_by_page: Dict[int, PageExtraction] = {}
+        for num_page, page in enumerate(
+            tqdm(doc, desc=f"Reading pdf : '{path_pdf}'"), start=1
+        ):
+            start = time.perf_counter()
+            text = page.get_text()
+            seconds = time.perf_counter() - start
+
+            if len(text.strip()) < MIN_CHARS_TEXT_PAGE:
+                pages_to_ocr.append(num_page)
+                native_by_page[num_page] = PageExtraction(
+                    num_page, text, METHOD_FAILED, seconds
+                )
+                continue
+
+            extractions[num_page] = PageExtraction(num_page, text, METHOD_TEXT, seconds)
+
+        # 2. ocr of the image-only pages, rendered from the opened doc
+        seconds_render: Dict[int, float] = {}
+        seconds_ocr: Dict[int, float] = {}
+
+        def render_pages() -> Iterator[Tuple[int, Image.Image]]:
+            for num_page in pages_to_ocr:
+                start = time.perf_counter()
+                pixmap = doc[num_page - 1].get_pixmap(dpi=dpi)
+                image = Image.frombytes(
+                    "RGB", (pixmap.width, pixmap.height), pixmap.samples
+                )
+                seconds_render[num_page] = time.perf_counter() - start
+                yield num_page, image
+
+        # a page whose ocr fails does not lose the others
+        errors_by_page: Dict[int, str] = {}
+        text_by_page: Dict[int, str] = {}
+        if pages_to_ocr:
+            try:
+                text_by_page = ocr_images(
+                    render_pages(),
+                    language=language,
+                    dpi=dpi,
+                    total=len(pages_to_ocr),
+                    max_workers=max_workers,
+                    seconds_by_page=seconds_ocr,
+                    errors_by_page=errors_by_page,
+                )
+            except Exception as e:  # rendering or pool failure
+                print(f"OCR of '{path_pdf}' failed : {e}")
+            for num_page, text in text_by_page.items():
+                extractions[num_page] = PageExtraction(
+                    num_page,
+                    text,
+                    METHOD_OCR,
+                    seconds_render[num_page] + seconds_ocr[num_page],
+                )
+
+        for num_page in pages_to_ocr:
+            if num_page not in extractions:
+                if num_page in errors_by_page:
+                    print(f"OCR of page {num_page} failed : {errors_by_page[num_page]}")
+                extractions[num_page] = native_by_page[num_page]
+
+    # report
+    extractions = [extractions[num_page] for num_page in sorted(extractions)]
+    for method in [METHOD_TEXT, METHOD_OCR, METHOD_FAILED]:
+        pages = [e for e in extractions if e.method == method]
+        print(
+            f"'{path_pdf.name}' : {len(pages)} page(s) by {method} "
+            f"in {sum(e.seconds for e in pages):.2f}s"
+        )
+
+    return extractions
+
+
+if __name__ == "__main__":
+    import fire
+
+    def main(path_pdf: str, language: str = "eng", dpi: int = 300) -> None:
+        for e in read_pdf_mixed(Path(path_pdf), language=language, dpi=dpi):
+            print(f"Page {e.page} : {e.method} ({e.seconds:.3f}s)")
+
+    fire.Fire(main)
@@ -0,0 +1,147 @@
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from backend.saint_amand.compress_cells import (
+    PERCENTAGE_STRING_MAX_GROUP,
+    compress_grouped,
+)
+from backend.saint_amand.near_duplicates import (
+    compute_groups,
+    find_near_pairs,
+    find_near_pairs_between,
+)
+from helper import cache
+
+FOLDER_CELL_GROUPS = "cell_groups"
+
+COLUMNS_INFOS = ["date", "num_cr", "page_table_start", "line_order"]
+
+
+class CellGroups:
+    """
+    Near-duplicate groups of the cells of one project, kept between runs.
+
+    A new cell is first matched by its exact text. Otherwise it is compared to
+    the known distinct cells whose length and q-grams are near enough, and
+    its pairs are added to the known ones : the pairs already found are never
+    computed again. All the distinct cells of a group act as its
+    representatives, so the groups are the same as compress_cells on all the
+    rows at once.
+    """
+
+    def __init__(self, project_title: str):
+        self.project_title = project_title
+
+        # distinct cells in order of first appearance, and their exact-text map
+        self.cells: List[str] = []
+        self.idx_by_cell: Dict[str, int] = {}
+
+        # infos of the rows of each distinct cell, in order of appearance
+        self.infos: Dict[str, List[list]] = {col: [] for col in COLUMNS_INFOS}
+
+        # pairs of near distinct cells
+        self.pairs = np.zeros((0, 2), dtype=np.int64)
+
+    def add_tables(self, df_tables: pd.DataFrame) -> None:
+
+        # 1. exact text
+        nb_known = len(self.cells)
+        for cell, *infos in zip(
+            df_tables["cell"],
+            df_tables["date"].to_numpy(),
+            *(df_tables[col].tolist() for col in COLUMNS_INFOS[1:]),
+        ):
+            idx = self.idx_by_cell.get(cell)
+            if idx is None:
+                idx = self.idx_by_cell[cell] = len(self.cells)
+                self.cells.append(cell)
+                for col in COLUMNS_INFOS:
+                    self.infos[col].append([])
+
+            for col, info in zip(COLUMNS_INFOS, infos):
+                self.infos[col][idx].append(info)
+
+        # 2. near cells : between the new ones, and with the known ones
+        cells_new = self.cells[nb_known:]
+        pairs_new = find_near_pairs(cells_new, PERCENTAGE_STRING_MAX_GROUP) + nb_known
+        pairs_known = find_near_pairs_between(
+            cells_new, self.cells[:nb_known], PERCENTAGE_STRING_MAX_GROUP
+        )
+        pairs_known[:, 0] += nb_known
+
+        self.pairs = np.concatenate([self.pairs, pairs_new, pairs_known])
+
+    def to_compressed(self) -> pd.DataFrame:
+
+        # distinct cells sorted like a group by cell
+        order = sorted(range(len(self.cells)), key=self.cells.__getitem__)
+        rank = np.empty(len(self.cells), dtype=np.int64)
+        rank[order] = np.arange(len(self.cells))
+
+        df_grouped = pd.DataFrame(
+            {
+                "cell": [self.cells[idx] for idx in order],
+                "date": [
+                    pd.unique(np.array(self.infos["date"][idx], dtype="datetime64[ns]"))
+                    for idx in order
+                ],
+                **{
+                    col: [self.infos[col][idx] for idx in order]
+                    for col in COLUMNS_INFOS[1:]
+                },
+            }
+        )
+
+        # pairs in the sorted indexes, sorted
+        pairs = np.sort(rank[self.pairs], axis=1)
+        pairs = pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
+        df_grouped["group"] = compute_groups(len(self.cells), pairs)
+
+        return compress_grouped(self.project_title, df_grouped)
+
+    # ----------------- Cache -----------------
+
+    @staticmethod
+    def _filename(project_title: str) -> str:
+        return f"{FOLDER_CELL_GROUPS}/{cache.compute_key(project_title, 12)}.json"
+
+    def save(self) -> None:
+        infos = {
+            "date": [
+                np.array(dates, dtype="datetime64[ns]").astype(np.int64).tolist()
+                for dates in self.infos["date"]
+            ],
+            **{
+                col: [[int(e) for e in lst] for lst in self.infos[col]]
+                for col in COLUMNS_INFOS[1:]
+            },
+        }
+        cache.save(
+            self._filename(self.project_title),
+            {
+                "project_title": self.project_title,
+                "cells": self.cells,
+                "infos": infos,
+                "pairs": self.pairs.tolist(),
+            },
+        )
+
+    @classmethod
+    def load(cls, project_title: str) -> Optional["CellGroups"]:
+        obj = cache.load(cls._filename(project_title))
+        if obj is None:
+            return None
+
+        groups = cls(project_title)
+        groups.cells = obj["cells"]
+        groups.idx_by_cell = {cell: idx for idx, cell in enumerate(groups.cells)}
+        groups.infos = obj["infos"]
+        groups.infos["date"] = [
+            list(np.array(dates, dtype=np.int64).astype("datetime64[ns]"))
+            for dates in groups.infos["date"]
+        ]
+        groups.pairs = np.array(obj["pairs"], dtype=np.int64).reshape((-1, 2))
+
+        return groups
@@ -1,30 +1,62 @@
-import Levenshtein
-import networkx as nx
+from typing import List
+
 import numpy as np
 import pandas as pd
 
+from backend.rag.retriever import get_encoder
+from backend.saint_amand.near_duplicates import (
+    compute_groups,
+    find_near_pairs,
+    find_similar_pairs,
+)
+from vars import PATH_MODEL_MINI
+
 DISTANCE_STRING_MAX_GROUP = 5
 PERCENTAGE_STRING_MAX_GROUP = 10
 
+# "levenshtein" : near spelling, "embedding" : near meaning (reworded actions)
+GROUPING_MODES = ["levenshtein", "embedding"]
+GROUPING_MODE = "levenshtein"
+
+COSINE_MIN_GROUP = 0.9
+BATCH_SIZE_ENCODE = 256
+
 
 def custom_agg(series: pd.Series):
 
     if isinstance(series.iloc[0], str):  # or isinstance(series.iloc[0], np.int64):
         return series.iloc[0]
 
-    if isinstance(series.iloc[0], np.ndarray) or isinstance(series.iloc[0], list):
-        return sum(
-            [
-                (e.tolist() if isinstance(series.iloc[0], np.ndarray) else e)
-                for e in series
-            ],
-            [],
-        )
+    if isinstance(series.iloc[0], list):
+        return sum(series, [])
+
+    # the dates, unique by cell : datetime64 arrays kept as such
+    if isinstance(series.iloc[0], (np.ndarray, pd.api.extensions.ExtensionArray)):
+        return np.concatenate([np.asarray(e) for e in series])
 
     raise Exception(f"Not handled (type:{type(series.iloc[0])})")
 
 
-def compress_cells(project_title: str, df_tables: pd.DataFrame) -> pd.DataFrame:
+def find_pairs(cells: List[str], mode: str = GROUPING_MODE) -> np.ndarray:
+    # pairs (idx1, idx2), idx1 < idx2, of cells to merge, sorted
+
+    if mode == "levenshtein":
+        # only the candidates allowed by the length and q-gram bounds are
+        # checked with a bounded levenshtein distance
+        return find_near_pairs(cells, PERCENTAGE_STRING_MAX_GROUP)
+
+    if mode == "embedding":
+        embeddings = get_encoder(PATH_MODEL_MINI).encode(
+            cells, batch_size=BATCH_SIZE_ENCODE, normalize_embeddings=True
+        )
+        return find_similar_pairs(embeddings, COSINE_MIN_GROUP)
+
+    raise ValueError(f"Grouping mode '{mode}' not in {GROUPING_MODES}")
+
+
+def compress_cells(
+    project_title: str, df_tables: pd.DataFrame, mode: str = GROUPING_MODE
+) -> pd.DataFrame:
 
     # 1. simple group by cell string
     aggregatation = {
@@ -35,47 +67,18 @@ def compress_cells(project_title: str, df_tables: pd.DataFrame) -> pd.DataFrame:
     }
     df_grouped = df_tables.groupby("cell").aggregate(aggregatation).reset_index()
 
-    # 2. compute levenshtein distance for all combinations
-    distances = []
-    for idx1, cell1 in enumerate(df_grouped["cell"]):
-        for idx2, cell2 in enumerate(
-            df_grouped["cell"].iloc[idx1 + 1 :], start=idx1 + 1
-        ):
-            score = Levenshtein.distance(cell1, cell2)
-            distances.append(
-                {
-                    "idx1": idx1,
-                    "idx2": idx2,
-                    "dst": score,
-                    "len_min": min(len(cell1), len(cell2)),
-                }
-            )
-    df_distances = pd.DataFrame(distances)
-
-    # 3. make groups of cells to merged with the Graph connected components algorithm
+    # 2. find the pairs of near cells
+    cells = df_grouped["cell"].tolist()
+    pairs = find_pairs(cells, mode)
 
-    # keep only the links between near strings
-    df_distances_filtred = df_distances[
-        df_distances["dst"]
-        <= df_distances["len_min"] * PERCENTAGE_STRING_MAX_GROUP / 100
-    ]
-
-    # build graph
-    G = nx.from_edgelist(
-        edgelist=zip(df_distances_filtred["idx1"], df_distances_filtred["idx2"])
-    )
+    # 3. make groups of cells to merged with a union-find on the pairs
+    df_grouped["group"] = compute_groups(len(cells), pairs)
 
-    # add those that are not in the levenshtein distance
-    for node in range(len(df_grouped)):
-        if node not in G.nodes:
-            G.add_node(node)
+    return compress_grouped(project_title, df_grouped)
 
-    groups_to_merge = list(nx.connected_components(G))
 
-    # store the info of group in the dataframe
-    df_grouped["group"] = None
-    for id_group, group in enumerate(groups_to_merge):
-        df_grouped.loc[list(group), "group"] = id_group
+def compress_grouped(project_title: str, df_grouped: pd.DataFrame) -> pd.DataFrame:
+    # df_grouped : one row per distinct cell, sorted by cell, with its group
 
     # 4. group and apply aggregation
     df_compressed_info = df_grouped.groupby("group").agg(custom_agg)
@@ -97,7 +100,7 @@ def compress_cells(project_title: str, df_tables: pd.DataFrame) -> pd.DataFrame:
         inplace=True,
     )
 
-    # remove duplicated dates
+    # remove duplicated dates, sorted
     df["dates"] = df["dates"].apply(lambda dates: np.unique(dates))
 
     # take the line_order of the first CR of each action
@@ -106,7 +109,7 @@ def compress_cells(project_title: str, df_tables: pd.DataFrame) -> pd.DataFrame:
     )
 
     # sort
-    for col in ["dates", "nums_cr", "pages_table_start"]:
+    for col in ["nums_cr", "pages_table_start"]:
         df[col] = df[col].apply(lambda lst: sorted(lst))
 
     # add title
@@ -115,3 +118,21 @@ def compress_cells(project_title: str, df_tables: pd.DataFrame) -> pd.DataFrame:
     # 6. return
     assert "dates" in df_compressed_info.columns
     return df_compressed_info
+
+
+if __name__ == "__main__":
+    import time
+
+    from backend.saint_amand.extract_all_infos import load_df_tables
+
+    # compare the grouping modes on the cached tables
+    df_tables = load_df_tables()
+    for title in df_tables["title"].unique():
+        df = df_tables[df_tables["title"] == title]
+        for mode in GROUPING_MODES:
+            start = time.time()
+            df_compressed = compress_cells(title, df, mode)
+            print(
+                f"{title} ; {mode} : {df['cell'].nunique()} cells -> "
+                f"{len(df_compressed)} groups in {time.time() - start:.1f}s"
+            )
@@ -6,16 +6,13 @@ from typing import List, Optional, Tuple, Union
 
 import numpy as np
 import pandas as pd
-from tqdm import tqdm
 
-from backend.read_pdf import read_pdf
-from backend.saint_amand.compress_cells import compress_cells
-from backend.saint_amand.compute_cr_page_number import compute_cr_page_numbers
-from backend.saint_amand.split_page_into_projects import split_pages_into_projects
-from backend.saint_amand.split_project_into_cells import split_projects_into_cells
+from backend.saint_amand.filter_index import FilterIndex, to_days
 from frontend.filters import Filters
 from helper import cache
-from vars import PATH_DOCS, PATH_SAINT_AMAND_INTEGRAL
+from vars import PATH_DOCS
+
+PROJECTS_SAINT_AMAND = ["Lot 2 ", "Lot 14 ", "Lot 24 "]
 
 # ----------------- Helper -----------------
 
@@ -74,9 +71,10 @@ def compute_cond_date(
     if not date_bounds:
         return pd.Series([True] * len(df))
 
-    return (date_bounds[0].strftime("%d/%m/%Y") <= df["date"]) & (
-        df["date"] <= date_bounds[1].strftime("%d/%m/%Y")
-    )
+    # compared as days, vectorized
+    days = to_days(df["date"].to_numpy())
+    day_min, day_max = to_days(date_bounds)
+    return pd.Series((day_min <= days) & (days <= day_max), index=df.index)
 
 
 # ----------------- Filters conditions -----------------
@@ -104,129 +102,110 @@ def filter_tables(
 
 
 def filter_compressed(
-    df_compressed: List[pd.DataFrame],
+    df_compressed: pd.DataFrame,
     projects_to_extract: Optional[Union[str, List[str]]],
     date_bounds: Optional[Tuple[datetime, datetime]] = None,
     cr_num_bounds: Optional[Tuple[int, int]] = None,
-) -> List[pd.DataFrame]:
+) -> pd.DataFrame:
+    # for repeated filtering of the same data, keep a FilterIndex
+    rows = FilterIndex(df_compressed).select(
+        projects_to_extract, date_bounds, cr_num_bounds
+    )
+    return df_compressed.iloc[rows]
 
-    df_cond = df_compressed.copy()
 
-    # pre-process
-    df_cond["num_cr"] = df_cond["nums_cr"].apply(lambda nums: min(nums))
-    df_cond["date"] = df_cond["dates"].apply(lambda dates: min(dates))
+# ----------------- Save -----------------
 
-    # apply conditions
-    return df_compressed[
-        compute_cond_projects(df_cond, projects_to_extract)
-        & compute_cond_date(df_cond, date_bounds)
-        & compute_cond_num_cr(df_cond, cr_num_bounds)
-    ]
+# list columns of df_compressed
+COLUMNS_LISTS = ["dates", "nums_cr", "pages_table_start"]
 
 
-# ----------------- Save -----------------
+def save_df_compressed(df_compressed: pd.DataFrame) -> None:
+    # lists and dates are stored natively by the parquet format
+    df_compressed = df_compressed.copy()
+    for col in COLUMNS_LISTS:
+        df_compressed[col] = df_compressed[col].apply(list)
+
+    cache.save("df_compressed.parquet", df_compressed)
 
 
 def save_infos(
     df_cr: pd.DataFrame, df_tables: pd.DataFrame, df_compressed: pd.DataFrame
 ) -> None:
-    cache.save("df_cr.csv", df_cr)
-    cache.save("df_tables.csv", df_tables)
-
-    # pre-process
-    df_compressed = df_compressed.copy()
-    df_compressed["dates"] = df_compressed["dates"].apply(
-        lambda dates: [date.strftime("%d-%m-%Y") for date in dates]
-    )
-
-    cache.save("df_compressed.csv", df_compressed)
+    cache.save("df_cr.parquet", df_cr)
+    cache.save("df_tables.parquet", df_tables)
+    save_df_compressed(df_compressed)
 
 
 # ----------------- Load -----------------
 
+# the csv files saved before the parquet format are read once then converted
+
 
 def load_df_cr() -> Optional[pd.DataFrame]:
-    return cache.load("df_cr.csv")
+    df = cache.load("df_cr.parquet")
+    if df is None:
+        df = cache.load("df_cr.csv")
+        if df is not None:
+            cache.save("df_cr.parquet", df)
+
+    return df
 
 
 def load_df_tables() -> Optional[pd.DataFrame]:
-    return cache.load("df_tables.csv")
+    df = cache.load("df_tables.parquet")
+    if df is None:
+        df = cache.load("df_tables.csv")
+        if df is None:
+            return None
 
+        # convert dates, as computed by split_projects_into_cells
+        df["date"] = pd.to_datetime(df["date"]).astype("datetime64[ns]")
+        cache.save("df_tables.parquet", df)
 
-def load_df_compressed() -> Optional[pd.DataFrame]:
+    return df
+
+
+def _load_legacy_df_compressed() -> Optional[pd.DataFrame]:
     df = cache.load("df_compressed.csv")
+    if df is None:
+        return None
 
     # convert nums_cr and pages
     df["nums_cr"] = df["nums_cr"].apply(json.loads)
     df["pages_table_start"] = df["pages_table_start"].apply(json.loads)
 
     # convert dates
-    convert_to_dates = lambda dates: [
-        datetime.strptime(date_string, "%d-%m-%Y")
-        for date_string in json.loads(dates.replace("'", '"'))
-    ]
+    convert_to_dates = lambda dates: np.array(
+        [
+            datetime.strptime(date_string, "%d-%m-%Y")
+            for date_string in json.loads(dates.replace("'", '"'))
+        ],
+        dtype="datetime64[ns]",
+    )
     df["dates"] = df["dates"].apply(convert_to_dates)
 
     return df
 
 
-# ----------------- Main -----------------
-
-
-def extract_infos_saint_amand(
-    projects_to_extract: Optional[Union[str, List[str]]],
-    date_bounds: Optional[Tuple[datetime, datetime]] = None,
-    cr_num_bounds: Optional[Tuple[int, int]] = None,
-) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
-
-    path_pdf = PATH_SAINT_AMAND_INTEGRAL
-
-    # 1. read
-    pages = read_pdf(path_pdf)
-
-    # 2. cr
-    df_cr = compute_cr_page_numbers(pages)
-
-    # filter by cr numbers
-    df_cr = filter_cr(df_cr, cr_num_bounds)
-
-    # 3. row tables
-    df_row_tables = split_pages_into_projects(pages, df_cr)
-
-    # 4. tables
-    df_tables = split_projects_into_cells(df_row_tables)
-
-    # filter by project name and dates
-    df_tables = filter_tables(
-        df_tables, projects_to_extract=projects_to_extract, date_bounds=date_bounds
-    )
-
-    # error handling
-    if len(projects_to_extract) != len(df_tables["title"].unique()):
-        raise RuntimeError(
-            f"{projects_to_extract} ; {df_tables['title'].unique().tolist()}"
-        )
-
-    # 5. compress
+def load_df_compressed() -> Optional[pd.DataFrame]:
+    # list columns are numpy arrays, dates are datetime64
+    df = cache.load("df_compressed.parquet")
+    if df is None:
+        df = _load_legacy_df_compressed()
+        if df is None:
+            return None
+        save_df_compressed(df)
+        df = cache.load("df_compressed.parquet")
 
-    dfs_compressed: List[pd.DataFrame] = []
-    for project_title in tqdm(df_tables["title"].unique(), desc="Compress infos"):
-        df = compress_cells(
-            project_title, df_tables[df_tables["title"].str.contains(project_title)]
-        )
-        dfs_compressed.append(df)
+    return df
 
-    df_compressed = pd.concat(dfs_compressed, axis="index")
 
-    # 6. return
-    return df_cr, df_tables, df_compressed
+# ----------------- Main -----------------
 
 
 if __name__ == "__main__":
-    projects = ["Lot 2 ", "Lot 14 ", "Lot 24 "]
-    df_cr, df_tables, df_compressed = extract_infos_saint_amand(
-        projects_to_extract=projects
-    )
+    from backend.saint_amand.pipeline import run_pipeline
 
-    if True:
-        save_infos(df_cr, df_tables, df_compressed)
+    # stale stages only, see backend.saint_amand.pipeline
+    run_pipeline()
@@ -0,0 +1,73 @@
+from datetime import date
+from typing import List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+
+def to_days(dates) -> np.ndarray:
+    # days since epoch of dates, datetimes or datetime64, NaT as the minimum int
+    return np.asarray(dates, dtype="datetime64[D]").astype(np.int64)
+
+
+class FilterIndex:
+    """
+    Index of df_compressed built once, to select the rows of the filters
+    without touching the dataframe : sorted first cr numbers and first dates,
+    searched by bisection, and a boolean mask per project title. Dates are
+    compared as days.
+    """
+
+    def __init__(self, df_compressed: pd.DataFrame):
+        self.nb_rows = len(df_compressed)
+
+        # first cr and first date of each row, sorted
+        nums_cr = np.array([min(nums) for nums in df_compressed["nums_cr"]])
+        dates = to_days([np.min(dates) for dates in df_compressed["dates"]])
+        self.order_num_cr = np.argsort(nums_cr, kind="stable")
+        self.sorted_num_cr = nums_cr[self.order_num_cr]
+        self.order_date = np.argsort(dates, kind="stable")
+        self.sorted_date = dates[self.order_date]
+
+        # rows of each title
+        titles, codes = np.unique(df_compressed["title"], return_inverse=True)
+        self.mask_by_title = {title: codes == idx for idx, title in enumerate(titles)}
+
+    def _select_range(
+        self, order: np.ndarray, sorted_values: np.ndarray, bounds: Tuple[int, int]
+    ) -> np.ndarray:
+        start = np.searchsorted(sorted_values, bounds[0], side="left")
+        end = np.searchsorted(sorted_values, bounds[1], side="right")
+        mask = np.zeros(self.nb_rows, dtype=bool)
+        mask[order[start:end]] = True
+        return mask
+
+    def select(
+        self,
+        projects_to_extract: Optional[Union[str, List[str]]] = None,
+        date_bounds: Optional[Tuple[date, date]] = None,
+        cr_num_bounds: Optional[Tuple[int, int]] = None,
+    ) -> np.ndarray:
+        """Sorted positions of the rows kept by the filters, same args as filter_compressed."""
+
+        mask = np.ones(self.nb_rows, dtype=bool)
+
+        if projects_to_extract:
+            if isinstance(projects_to_extract, str):
+                projects_to_extract = [projects_to_extract]
+            mask_projects = np.zeros(self.nb_rows, dtype=bool)
+            for title, mask_title in self.mask_by_title.items():
+                if any(project in title for project in projects_to_extract):
+                    mask_projects |= mask_title
+            mask &= mask_projects
+
+        if date_bounds:
+            bounds = tuple(to_days(date_bounds))
+            mask &= self._select_range(self.order_date, self.sorted_date, bounds)
+
+        if cr_num_bounds:
+            mask &= self._select_range(
+                self.order_num_cr, self.sorted_num_cr, cr_num_bounds
+            )
+
+        return np.flatnonzero(mask)
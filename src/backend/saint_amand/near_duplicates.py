@@ -0,0 +1,254 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
+
+import Levenshtein
+import numpy as np
+
+# buckets of the hashed 1-gram and 2-gram histograms
+NB_BUCKETS_1GRAMS = 128
+NB_BUCKETS_2GRAMS = 256
+
+# under this number of strings, the process pool is not worth it
+MIN_STRINGS_POOL = 2000
+# number of strings whose candidates are checked by one worker task
+STRINGS_PER_TASK = 500
+
+# number of rows of the similarity matrix computed at once
+BLOCK_SIZE_SIMILARITY = 1024
+
+
+class UnionFind:
+    """Array-backed union-find with path halving and union by size."""
+
+    def __init__(self, n: int):
+        self.parent = np.arange(n)
+        self.size = np.ones(n, dtype=np.int64)
+
+    def find(self, x: int) -> int:
+        parent = self.parent
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    def union(self, x: int, y: int) -> None:
+        x, y = self.find(x), self.find(y)
+        if x == y:
+            return
+        if self.size[x] < self.size[y]:
+            x, y = y, x
+        self.parent[y] = x
+        self.size[x] += self.size[y]
+
+    def roots(self) -> np.ndarray:
+        return np.array([self.find(x) for x in range(len(self.parent))])
+
+
+def compute_max_distance(len_min: np.ndarray, percentage: int) -> np.ndarray:
+    # dst <= len_min * percentage / 100 with dst an integer
+    return len_min * percentage // 100
+
+
+def _compute_histograms(strings: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    hist1 = np.zeros((len(strings), NB_BUCKETS_1GRAMS), dtype=np.int32)
+    hist2 = np.zeros((len(strings), NB_BUCKETS_2GRAMS), dtype=np.int32)
+    for idx, string in enumerate(strings):
+        codes = np.frombuffer(string.encode("utf-32-le"), dtype=np.uint32)
+        np.add.at(hist1[idx], codes % NB_BUCKETS_1GRAMS, 1)
+        np.add.at(hist2[idx], (codes[:-1] * 31 + codes[1:]) % NB_BUCKETS_2GRAMS, 1)
+    return hist1, hist2
+
+
+# strings of the worker processes, sorted by length
+_strings: List[str] = []
+_lengths: np.ndarray = np.zeros(0)
+_hist1: np.ndarray = np.zeros(0)
+_hist2: np.ndarray = np.zeros(0)
+_percentage: int = 0
+
+
+def _init_worker(strings, lengths, hist1, hist2, percentage) -> None:
+    global _strings, _lengths, _hist1, _hist2, _percentage
+    _strings, _lengths, _hist1, _hist2 = strings, lengths, hist1, hist2
+    _percentage = percentage
+
+
+def _find_pairs(start: int, end: int) -> List[Tuple[int, int]]:
+    """Pairs (i, j), i < j, of near strings for i in [start, end)."""
+
+    pairs = []
+    ends = np.searchsorted(
+        _lengths, _lengths + compute_max_distance(_lengths, _percentage), side="right"
+    )
+    for i in range(start, end):
+        # the shortest string is i : its length bounds the distance
+        max_dst = int(compute_max_distance(_lengths[i], _percentage))
+        candidates = np.arange(i + 1, ends[i])
+        if len(candidates) == 0:
+            continue
+
+        # lossless q-gram bounds : an edit changes the 1-gram histogram by at
+        # most 2 and the 2-gram one by at most 4
+        l1_1grams = np.abs(_hist1[candidates] - _hist1[i]).sum(axis=1)
+        l1_2grams = np.abs(_hist2[candidates] - _hist2[i]).sum(axis=1)
+        candidates = candidates[(l1_1grams <= 2 * max_dst) & (l1_2grams <= 4 * max_dst)]
+
+        # bounded edit distance on the remaining candidates
+        for j in candidates:
+            dst = Levenshtein.distance(_strings[i], _strings[j], score_cutoff=max_dst)
+            if dst <= max_dst:
+                pairs.append((i, int(j)))
+
+    return pairs
+
+
+def find_near_pairs(
+    strings: List[str], percentage: int, max_workers: Optional[int] = None
+) -> np.ndarray:
+    """
+    All the pairs (idx1, idx2), idx1 < idx2, of strings whose Levenshtein
+    distance is at most `percentage` % of the length of the shortest one,
+    sorted like the pairs of a double loop.
+    """
+
+    if len(strings) < 2:
+        return np.zeros((0, 2), dtype=np.int64)
+
+    # sort by length so that the candidates of a string are a contiguous range
+    order = np.argsort([len(s) for s in strings], kind="stable")
+    strings_sorted = [strings[idx] for idx in order]
+    lengths = np.array([len(s) for s in strings_sorted])
+    hist1, hist2 = _compute_histograms(strings_sorted)
+    args = strings_sorted, lengths, hist1, hist2, percentage
+
+    tasks = [
+        (start, min(start + STRINGS_PER_TASK, len(strings)))
+        for start in range(0, len(strings), STRINGS_PER_TASK)
+    ]
+    if len(strings) < MIN_STRINGS_POOL:
+        _init_worker(*args)
+        results = [_find_pairs(*task) for task in tasks]
+    else:
+        max_workers = max_workers or os.cpu_count() or 1
+        # spawn : no fork of the pipeline threads, the strings are sent by initargs
+        with ProcessPoolExecutor(
+            max_workers=max_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=args,
+        ) as executor:
+            results = list(executor.map(_find_pairs, *zip(*tasks)))
+
+    pairs = np.array(
+        [pair for result in results for pair in result], dtype=np.int64
+    ).reshape((-1, 2))
+
+    # back to the original indexes, sorted
+    pairs = np.sort(order[pairs], axis=1)
+    return pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
+
+
+def compute_groups(n: int, pairs: np.ndarray) -> np.ndarray:
+    """
+    Group id of each of the n nodes, the groups being the connected components
+    of the pairs. Ids are numbered like networkx.connected_components on a graph
+    built from the pairs then completed with the isolated nodes.
+    """
+
+    union_find = UnionFind(n)
+    for idx1, idx2 in pairs:
+        union_find.union(idx1, idx2)
+    roots = union_find.roots()
+
+    # nodes in order of first appearance in the pairs, then the isolated ones
+    flat = pairs.ravel()
+    nodes, first_appearance = np.unique(flat, return_index=True)
+    nodes_order = np.concatenate(
+        [nodes[np.argsort(first_appearance)], np.setdiff1d(np.arange(n), nodes)]
+    )
+
+    # a group id is the rank of its first node
+    roots_order = roots[nodes_order]
+    unique_roots, first_root = np.unique(roots_order, return_index=True)
+    id_by_root = np.empty(n, dtype=np.int64)
+    id_by_root[unique_roots[np.argsort(first_root)]] = np.arange(len(unique_roots))
+
+    return id_by_root[roots]
+
+
+def find_near_pairs_between(
+    strings_new: List[str], strings_old: List[str], percentage: int
+) -> np.ndarray:
+    """
+    All the pairs (idx_new, idx_old) of near strings, with the same criterion as
+    find_near_pairs, between new strings and already known ones.
+    """
+
+    if not strings_new or not strings_old:
+        return np.zeros((0, 2), dtype=np.int64)
+
+    order = np.argsort([len(s) for s in strings_old], kind="stable")
+    lengths_old = np.array([len(strings_old[idx]) for idx in order])
+    hist1_old, hist2_old = _compute_histograms([strings_old[idx] for idx in order])
+    hist1_new, hist2_new = _compute_histograms(strings_new)
+
+    pairs = []
+    for idx_new, string in enumerate(strings_new):
+        length = len(string)
+
+        # the known strings whose length allows the distance
+        start = np.searchsorted(lengths_old, length * 100 // (100 + percentage))
+        end = np.searchsorted(
+            lengths_old, length + compute_max_distance(length, percentage), "right"
+        )
+        candidates = np.arange(start, end)
+        max_dst = compute_max_distance(
+            np.minimum(lengths_old[candidates], length), percentage
+        )
+
+        # length and lossless q-gram bounds
+        l1_1grams = np.abs(hist1_old[candidates] - hist1_new[idx_new]).sum(axis=1)
+        l1_2grams = np.abs(hist2_old[candidates] - hist2_new[idx_new]).sum(axis=1)
+        cond = (
+            (np.abs(lengths_old[candidates] - length) <= max_dst)
+            & (l1_1grams <= 2 * max_dst)
+            & (l1_2grams <= 4 * max_dst)
+        )
+
+        # bounded edit distance on the remaining candidates
+        for j, max_dst_j in zip(candidates[cond], max_dst[cond]):
+            idx_old = int(order[j])
+            dst = Levenshtein.distance(
+                string, strings_old[idx_old], score_cutoff=int(max_dst_j)
+            )
+            if dst <= max_dst_j:
+                pairs.append((idx_new, idx_old))
+
+    return np.array(pairs, dtype=np.int64).reshape((-1, 2))
+
+
+def find_similar_pairs(
+    embeddings: np.ndarray, threshold: float, block_size: int = BLOCK_SIZE_SIMILARITY
+) -> np.ndarray:
+    """
+    All the pairs (idx1, idx2), idx1 < idx2, of normalized embeddings whose
+    cosine similarity is at least `threshold`, sorted like the pairs of a double
+    loop. The similarity matrix is computed by blocks of rows, against the
+    following rows only, so the memory stays block_size x n.
+    """
+
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    pairs = []
+    for start in range(0, len(embeddings), block_size):
+        end = min(start + block_size, len(embeddings))
+        similarities = embeddings[start:end] @ embeddings[start:].T
+
+        rows, cols = np.nonzero(similarities >= threshold)
+        idx1, idx2 = rows + start, cols + start
+        cond = idx1 < idx2
+        pairs.append(np.stack([idx1[cond], idx2[cond]], axis=1))
+
+    pairs = np.concatenate(pairs) if pairs else np.zeros((0, 2), dtype=np.int64)
+    return pairs.astype(np.int64)
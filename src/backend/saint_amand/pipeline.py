@@ -0,0 +1,167 @@
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+import backend.rag.retriever
+import backend.read_pdf
+import backend.saint_amand.compress_cells
+import backend.saint_amand.compute_cr_page_number
+import backend.saint_amand.extract_all_infos
+import backend.saint_amand.filter_index
+import backend.saint_amand.near_duplicates
+import backend.saint_amand.split_page_into_projects
+import backend.saint_amand.split_project_into_cells
+from backend.rag.retriever import get_encoder
+from backend.rag.saint_amand import publish_data
+from backend.read_pdf import read_pdf
+from backend.saint_amand.compress_cells import compress_cells
+from backend.saint_amand.compute_cr_page_number import compute_cr_page_numbers
+from backend.saint_amand.extract_all_infos import (
+    PROJECTS_SAINT_AMAND,
+    filter_tables,
+)
+from backend.saint_amand.split_page_into_projects import split_pages_into_projects
+from backend.saint_amand.split_project_into_cells import split_projects_into_cells
+from helper.pipeline import Pipeline, Stage
+from vars import PATH_MODEL_MINI, PATH_SAINT_AMAND_INTEGRAL
+
+# ----------------- Stages -----------------
+
+
+def _read(path_pdf: str) -> List[str]:
+    return read_pdf(Path(path_pdf))
+
+
+def _extract_tables(df_row_tables: pd.DataFrame, projects: List[str]) -> pd.DataFrame:
+    df_tables = filter_tables(
+        split_projects_into_cells(df_row_tables), projects_to_extract=projects
+    )
+
+    # error handling
+    if len(projects) != len(df_tables["title"].unique()):
+        raise RuntimeError(f"{projects} ; {df_tables['title'].unique().tolist()}")
+
+    return df_tables
+
+
+def _compress_project(df_tables: pd.DataFrame, project: str) -> pd.DataFrame:
+    titles = [title for title in df_tables["title"].unique() if project in title]
+    return pd.concat(
+        [
+            compress_cells(title, df_tables[df_tables["title"] == title])
+            for title in titles
+        ],
+        axis="index",
+    )
+
+
+def _concat(*dfs: pd.DataFrame) -> pd.DataFrame:
+    return pd.concat(dfs, axis="index", ignore_index=True)
+
+
+def _embed(df_compressed: pd.DataFrame) -> np.ndarray:
+    retriever = get_encoder(PATH_MODEL_MINI)
+    return retriever.encode(df_compressed["cell"].tolist(), show_progress_bar=True)
+
+
+# ----------------- DAG -----------------
+
+
+def build_pipeline(
+    path_pdf: Path = PATH_SAINT_AMAND_INTEGRAL,
+    projects: List[str] = PROJECTS_SAINT_AMAND,
+) -> Pipeline:
+    # one compress branch per project, run concurrently
+    stages_compress = [
+        Stage(
+            f"compress {project}",
+            _compress_project,
+            inputs=["tables"],
+            params={"project": project},
+            modules=[
+                backend.saint_amand.compress_cells,
+                backend.saint_amand.near_duplicates,
+                backend.rag.retriever,  # embedding grouping mode
+            ],
+        )
+        for project in projects
+    ]
+
+    return Pipeline(
+        [
+            Stage(
+                "pages",
+                _read,
+                params={"path_pdf": str(path_pdf)},
+                files=[path_pdf],
+                modules=[backend.read_pdf],
+            ),
+            Stage(
+                "cr",
+                compute_cr_page_numbers,
+                inputs=["pages"],
+                modules=[backend.saint_amand.compute_cr_page_number],
+            ),
+            Stage(
+                "row_tables",
+                split_pages_into_projects,
+                inputs=["pages", "cr"],
+                modules=[backend.saint_amand.split_page_into_projects],
+            ),
+            Stage(
+                "tables",
+                _extract_tables,
+                inputs=["row_tables"],
+                params={"projects": projects},
+                modules=[
+                    backend.saint_amand.split_project_into_cells,
+                    backend.saint_amand.extract_all_infos,  # filter_tables
+                    backend.saint_amand.filter_index,
+                ],
+            ),
+            *stages_compress,
+            Stage(
+                "compressed",
+                _concat,
+                inputs=[stage.name for stage in stages_compress],
+            ),
+            Stage(
+                "embeddings",
+                _embed,
+                inputs=["compressed"],
+                modules=[backend.rag.retriever],
+            ),
+        ]
+    )
+
+
+def run_pipeline(
+    path_pdf: Path = PATH_SAINT_AMAND_INTEGRAL,
+    projects: List[str] = PROJECTS_SAINT_AMAND,
+    max_workers: Optional[int] = None,
+) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """
+    Run the stale stages of the extraction and save the infos and embeddings
+    where the loaders expect them.
+    """
+
+    outputs = build_pipeline(path_pdf, projects).run(
+        targets=["cr", "tables", "compressed", "embeddings"], max_workers=max_workers
+    )
+    df_cr, df_tables, df_compressed = (
+        outputs["cr"],
+        outputs["tables"],
+        outputs["compressed"],
+    )
+
+    publish_data(df_cr, df_tables, df_compressed, outputs["embeddings"])
+
+    return df_cr, df_tables, df_compressed
+
+
+if __name__ == "__main__":
+    import fire
+
+    fire.Fire(run_pipeline)
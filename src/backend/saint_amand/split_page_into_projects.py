@@ -1,6 +1,7 @@
+import multiprocessing
 import re
-from collections import namedtuple
-from typing import List, Tuple
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
 
 import pandas as pd
 from tqdm import tqdm
@@ -26,61 +27,91 @@ OTHER_TABLES = [
 ]
 
 
-def _is_start_line_table(line: str) -> bool:
-    if line.startswith("Lot"):
-        return True
-    return any(line.startswith(e + " ") for e in OTHER_TABLES)
-
-
-def split_pages_into_projects(pages: TYPE_PAGES, df_cr: pd.DataFrame) -> pd.DataFrame:
-
-    tables: List[dict] = []
-    Buffer = namedtuple("Buffer", "start_page text")
-
-    # process pages by cr
-    for _, row in tqdm(list(df_cr.iterrows()), "Split pages into projects"):
-        cr, start, end = row["num_cr"], row["page_start"], row["page_end"]
-        lst: List[Tuple[int, int, str]] = []
+PATTERN_HEADER = re.compile(
+    r"Communauté d’Agglomération des Portes du Hainaut.*\n Page \d* sur \d*"
+)
+PATTERN_START_TABLE = re.compile(
+    "|".join(["Lot"] + [re.escape(e + " ") for e in OTHER_TABLES])
+)
 
-        buffer = Buffer(None, "")
+# under this number of crs, the process pool is not worth it
+MIN_CRS_POOL = 4
 
-        # process pages where projects tables are
-        for current_page in range(start + 3, end + 1):
 
-            text = pages[current_page - 1]
-
-            # remove header because it's just noise
-            text = re.sub(
-                pattern=r"Communauté d’Agglomération des Portes du Hainaut.*\n Page \d* sur \d*",
-                repl="",
-                string=text,
-            )
-
-            # detect and split projects
-            for line in [e for e in text.split("\n")]:
-
-                if _is_start_line_table(line):  # the start of a project
-                    # store the buffer
-                    lst.append((buffer.start_page, current_page, buffer.text))
-                    # reset the buffer
-                    buffer = Buffer(current_page, line)
-                else:  # the middle/end of a project
-                    # fill the buffer
-                    buffer = Buffer(buffer.start_page, buffer.text + "\n" + line)
-
-        # store the last one
-        lst.append((buffer.start_page, current_page, buffer.text))
-
-        # remove those that are not projects
-        tables.extend(
-            {
-                "num_cr": cr,
-                "page_table_start": page_start,
-                "page_table_end": page_end,
-                "text_table": text,
-            }
-            for page_start, page_end, text in lst
-            if _is_start_line_table(text)
+def _is_start_line_table(line: str) -> bool:
+    return PATTERN_START_TABLE.match(line) is not None
+
+
+def _split_cr_into_projects(
+    cr: int, start: int, end: int, pages_cr: TYPE_PAGES
+) -> List[dict]:
+    # pages_cr : pages of the cr where the projects tables are, from start + 3
+
+    lst: List[Tuple[int, int, str]] = []
+
+    # the buffer of the current table
+    buffer_start_page = None
+    buffer_lines: List[str] = [""]
+
+    # process pages where projects tables are
+    for current_page, text in enumerate(pages_cr, start=start + 3):
+
+        # remove header because it's just noise
+        text = PATTERN_HEADER.sub("", text)
+
+        # detect and split projects
+        for line in text.split("\n"):
+
+            if _is_start_line_table(line):  # the start of a project
+                # store the buffer
+                lst.append((buffer_start_page, current_page, "\n".join(buffer_lines)))
+                # reset the buffer
+                buffer_start_page, buffer_lines = current_page, [line]
+            else:  # the middle/end of a project
+                # fill the buffer
+                buffer_lines.append(line)
+
+    # store the last one
+    lst.append((buffer_start_page, end, "\n".join(buffer_lines)))
+
+    # remove those that are not projects
+    return [
+        {
+            "num_cr": cr,
+            "page_table_start": page_start,
+            "page_table_end": page_end,
+            "text_table": text,
+        }
+        for page_start, page_end, text in lst
+        if _is_start_line_table(text)
+    ]
+
+
+def split_pages_into_projects(
+    pages: TYPE_PAGES, df_cr: pd.DataFrame, max_workers: Optional[int] = None
+) -> pd.DataFrame:
+
+    # each cr is independent, only its pages are sent to the workers
+    tasks = [
+        (cr, start, end, pages[start + 2 : end])
+        for cr, start, end in zip(
+            df_cr["num_cr"], df_cr["page_start"], df_cr["page_end"]
         )
+    ]
+
+    if len(tasks) < MIN_CRS_POOL:
+        results = [_split_cr_into_projects(*task) for task in tasks]
+    else:
+        # spawn : a fork from the threads of the pipeline stages may deadlock
+        with ProcessPoolExecutor(
+            max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")
+        ) as executor:
+            results = list(
+                tqdm(
+                    executor.map(_split_cr_into_projects, *zip(*tasks)),
+                    total=len(tasks),
+                    desc="Split pages into projects",
+                )
+            )
 
-    return pd.DataFrame(tables)
+    return pd.DataFrame([table for tables in results for table in tables])
@@ -1,96 +1,149 @@
 import datetime
+import multiprocessing
 import re
-from typing import List, Tuple
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
 
 import pandas as pd
 from tqdm import tqdm
 
+PATTERN_DATE = re.compile(r"\d\d/\d\d/\d\d( |$)")
+
+COLUMNS_CELLS = [
+    "num_cr",
+    "page_table_start",
+    "page_table_end",
+    "title",
+    "company",
+    "date",
+    "cell",
+    "line_order",
+]
+
+# number of tables scanned by one worker task
+TABLES_PER_TASK = 256
+
+TYPE_COLUMNS = Dict[str, list]
+
+
+def _parse_date(date_str: str) -> datetime.date:
+    return datetime.date(
+        year=2000 + int(date_str[-2:]),
+        month=int(date_str[3:5]),
+        day=int(date_str[:2]),
+    )
+
+
+def _scan_tables(
+    nums_cr: List[int],
+    pages_table_start: List[int],
+    pages_table_end: List[int],
+    texts_table: List[str],
+) -> TYPE_COLUMNS:
+
+    columns: TYPE_COLUMNS = {col: [] for col in COLUMNS_CELLS}
+    dates: Dict[str, datetime.date] = {}
+
+    def store_cell(date: Optional[datetime.date], cell: str, line_order: int):
+        # remove empty cells
+        if cell.strip(" ") == "":
+            return
+        columns["date"].append(date)
+        columns["cell"].append(cell)
+        columns["line_order"].append(line_order)
+
+    for num_cr, page_start, page_end, text_table in zip(
+        nums_cr, pages_table_start, pages_table_end, texts_table
+    ):
+        nb_cells_before = len(columns["cell"])
 
-def _extract_cells_from_raw_text_table(
-    num_cr: int, page_table_start: int, page_table_end: int, text_table: str
-) -> List[dict]:
+        # split the lines
+        lines = text_table.split("\n")
 
-    # split the lines
-    lines = text_table.split("\n")
+        # save headers
+        title = lines[0].strip(" ")
+        company = lines[1]
 
-    # save headers
-    title = lines[0].strip(" ")
-    company = lines[1]
+        # init vars
+        buffer = ""
+        date = None
 
-    # init vars
-    cells: List[Tuple[str, str, int]] = []
-    buffer = ""
-    date = None
+        # go through cells line
+        for line_order, line in enumerate(lines[2:]):
+            if line.strip(" ") == "":  # two following newlines --> two differents cells
+                store_cell(date, buffer, line_order)
+                buffer = ""
 
-    # go through cells line
-    for line_order, line in enumerate(lines[2:]):
-        if line.strip(" ") == "":  # two following newlines --> two differents cells
-            # store the cell
-            cells.append((date, buffer, line_order))
-            # reset buffer
-            buffer = ""
+            elif PATTERN_DATE.match(line):  # a date -> end cell and start of a new one
+                store_cell(date, buffer, line_order)
 
-        elif re.match(
-            r"\d\d/\d\d/\d\d( |$)", line
-        ):  # match a date -> end cell and start of a new one
+                # extract the date
+                date_str = line[:8]
+                if date_str not in dates:
+                    dates[date_str] = _parse_date(date_str)
+                date = dates[date_str]
 
-            # store the cell
-            cells.append((date, buffer, line_order))
+                # extract the cell
+                buffer = line[8:].strip(" ")
 
-            # extract the date
-            date_str = line[:8]
-            date = datetime.date(
-                year=2000 + int(date_str[-2:]),
-                month=int(date_str[3:5]),
-                day=int(date_str[:2]),
-            )
+            else:  # newline without date but with text --> no new cell
 
-            # extract the cell
-            text_cell = line[8:].strip(" ")
+                # separe lines with a newline
+                if len(buffer) > 0 and buffer.strip(" ") != "":
+                    buffer += "\n"
 
-            # store in the buffer
-            buffer = text_cell
-        else:  # newline without date but with text --> no new cell
+                buffer += line
 
-            # separe lines with a newline
-            if len(buffer) > 0 and buffer.strip(" ") != "":
-                buffer += "\n"
+        # the table infos, repeated for each of its cells
+        nb_cells = len(columns["cell"]) - nb_cells_before
+        columns["num_cr"].extend([num_cr] * nb_cells)
+        columns["page_table_start"].extend([page_start] * nb_cells)
+        columns["page_table_end"].extend([page_end] * nb_cells)
+        columns["title"].extend([title] * nb_cells)
+        columns["company"].extend([company] * nb_cells)
 
-            buffer += line
+    return columns
 
-    # remove empty cells
-    cells = [
-        (date, text, line_order)
-        for date, text, line_order in cells
-        if text.strip(" ") != ""
-    ]
 
-    return [
-        {
-            "num_cr": num_cr,
-            "page_table_start": page_table_start,
-            "page_table_end": page_table_end,
-            "title": title,
-            "company": company,
-            "date": date,
-            "cell": cell,
-            "line_order": line_order,
-        }
-        for date, cell, line_order in cells
-    ]
+def split_projects_into_cells(
+    df_row_tables: pd.DataFrame, max_workers: Optional[int] = None
+) -> pd.DataFrame:
 
+    table_columns = ["num_cr", "page_table_start", "page_table_end", "text_table"]
+    if len(df_row_tables) == 0:
+        return pd.DataFrame(columns=COLUMNS_CELLS).astype({"date": "datetime64[ns]"})
 
-def split_projects_into_cells(df_row_tables: pd.DataFrame) -> pd.DataFrame:
+    # chunks of tables, as columns
+    tasks = [
+        [
+            df_row_tables[col].iloc[idx : idx + TABLES_PER_TASK].tolist()
+            for col in table_columns
+        ]
+        for idx in range(0, len(df_row_tables), TABLES_PER_TASK)
+    ]
+
+    if len(tasks) == 1:
+        results = [_scan_tables(*tasks[0])]
+    else:
+        # spawn : not forked from the pipeline threads
+        with ProcessPoolExecutor(
+            max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")
+        ) as executor:
+            results = list(
+                tqdm(
+                    executor.map(_scan_tables, *zip(*tasks)),
+                    total=len(tasks),
+                    desc="Split projects into cells",
+                )
+            )
 
-    data = []
+    # concatenate the columns of each chunk
+    df = pd.DataFrame(
+        {col: [e for result in results for e in result[col]] for col in COLUMNS_CELLS}
+    )
 
-    # process table by table
-    for _, table in tqdm(
-        df_row_tables.iterrows(),
-        total=len(df_row_tables),
-        desc="Split projects into cells",
-    ):
-        e = _extract_cells_from_raw_text_table(**table)
-        data.extend(e)
+    # dates as datetime64 (NaT before the first date of a table) : comparable
+    # and filtered as numbers
+    df["date"] = pd.Series(df["date"].tolist(), dtype="datetime64[ns]")
 
-    return pd.DataFrame(data)
+    return df
@@ -0,0 +1,193 @@
+import multiprocessing
+import threading
+import time
+from pathlib import Path
+from typing import Optional, Tuple
+
+import pandas as pd
+from tqdm import tqdm
+
+from backend.rag.saint_amand import (
+    compute_numerization,
+    load_data_retriever,
+    load_numerization,
+    publish_data,
+    select_data_retriever,
+)
+from backend.read_pdf import read_pdf
+from backend.saint_amand.cell_groups import CellGroups
+from backend.saint_amand.compress_cells import GROUPING_MODE, compress_cells
+from backend.saint_amand.compute_cr_page_number import compute_cr_page_numbers
+from backend.saint_amand.extract_all_infos import (
+    load_df_compressed,
+    load_df_cr,
+    load_df_tables,
+)
+from backend.saint_amand.pipeline import run_pipeline
+from backend.saint_amand.split_page_into_projects import split_pages_into_projects
+from backend.saint_amand.split_project_into_cells import split_projects_into_cells
+from helper import cache
+from vars import PATH_SAINT_AMAND_INTEGRAL
+
+WATCH_INTERVAL_SECONDS = 60
+
+# one update at a time, between the threads and the processes (servers)
+FILENAME_LOCK_UPDATE = "update_saint_amand"
+
+_lock_watcher = threading.Lock()
+_watcher: Optional[threading.Thread] = None
+
+
+def compute_new_crs(df_cr: pd.DataFrame, df_cr_old: pd.DataFrame) -> pd.DataFrame:
+    # the crs not processed yet or whose pages changed since the last run
+    df = df_cr.merge(
+        df_cr_old[["num_cr", "page_start", "page_end"]],
+        on="num_cr",
+        how="left",
+        suffixes=("", "_old"),
+    )
+    cond_new = (
+        df["page_start_old"].isna()
+        | (df["page_start"] != df["page_start_old"])
+        | (df["page_end"] != df["page_end_old"])
+    )
+    return df_cr[cond_new.values]
+
+
+def save_cell_groups(title: str, df_tables: pd.DataFrame) -> CellGroups:
+    groups = CellGroups(title)
+    groups.add_tables(df_tables)
+    groups.save()
+    return groups
+
+
+def update_infos_saint_amand(path_pdf: Path = PATH_SAINT_AMAND_INTEGRAL) -> bool:
+    """
+    Process only the crs appended to the integral since the last saved infos
+    and merge them into the cached tables and compressed cells. Return whether
+    something changed.
+    """
+
+    # 1. previous run
+    df_cr_old, df_tables_old = load_df_cr(), load_df_tables()
+    df_compressed_old = load_df_compressed()
+
+    if df_cr_old is None or df_tables_old is None or df_compressed_old is None:
+        print("No previous infos, full extraction...")
+        _, df_tables, _ = run_pipeline(path_pdf)
+        if GROUPING_MODE == "levenshtein":
+            for title in df_tables["title"].unique():
+                save_cell_groups(title, df_tables[df_tables["title"] == title])
+        return True
+
+    # 2. new crs (only the new pages are really read, the others are cached)
+    pages = read_pdf(path_pdf)
+    df_cr = compute_cr_page_numbers(pages)
+    df_cr_new = compute_new_crs(df_cr, df_cr_old)
+
+    if len(df_cr_new) == 0:
+        print("Saint-Amand infos already up to date")
+        return False
+
+    print(f"New CRs : {df_cr_new['num_cr'].tolist()}")
+
+    # 3. tables of the new crs, for the projects already extracted
+    titles = df_tables_old["title"].unique()
+    df_tables_new = split_projects_into_cells(
+        split_pages_into_projects(pages, df_cr_new)
+    )
+    df_tables_new = df_tables_new[df_tables_new["title"].isin(titles)]
+
+    df_tables = pd.concat(
+        [
+            df_tables_old[~df_tables_old["num_cr"].isin(df_cr_new["num_cr"])],
+            df_tables_new,
+        ],
+        ignore_index=True,
+    )
+
+    # 4. merge the new cells into the kept groups of their project : the groups
+    # are rebuilt only when a cr already grouped changed (the embedding grouping
+    # mode has no kept groups : its projects are compressed again)
+    titles_to_update = df_tables_new["title"].unique()
+    changed = df_cr_new["num_cr"].isin(df_cr_old["num_cr"]).any()
+    dfs_compressed = [
+        df_compressed_old[~df_compressed_old["title"].isin(titles_to_update)]
+    ]
+    for title in tqdm(titles_to_update, desc="Compress infos"):
+        if GROUPING_MODE != "levenshtein":
+            dfs_compressed.append(
+                compress_cells(title, df_tables[df_tables["title"] == title])
+            )
+            continue
+
+        groups = None if changed else CellGroups.load(title)
+        if groups is None:
+            groups = save_cell_groups(title, df_tables[df_tables["title"] == title])
+        else:
+            groups.add_tables(df_tables_new[df_tables_new["title"] == title])
+            groups.save()
+        dfs_compressed.append(groups.to_compressed())
+    df_compressed = pd.concat(dfs_compressed, axis="index", ignore_index=True)
+
+    # 5. encode only the cells not encoded yet, then save all together
+    previous = load_data_retriever()["cell"].tolist(), load_numerization()
+    embeddings = compute_numerization(select_data_retriever(df_compressed), previous)
+    publish_data(df_cr, df_tables, df_compressed, embeddings)
+
+    return True
+
+
+def _get_stat(path: Path) -> Optional[Tuple[int, int]]:
+    if not path.exists():
+        return None
+    stat = path.stat()
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _update(path_pdf: Path) -> None:
+    with cache.lock(FILENAME_LOCK_UPDATE):
+        update_infos_saint_amand(path_pdf)
+
+
+def run_update(path_pdf: Path = PATH_SAINT_AMAND_INTEGRAL) -> None:
+    # in a fresh process : the update forks process pools, unsafe from the
+    # threads of the web server
+    context = multiprocessing.get_context("spawn")
+    process = context.Process(target=_update, args=(path_pdf,))
+    process.start()
+    process.join()
+    if process.exitcode != 0:
+        raise RuntimeError(f"update exited with code {process.exitcode}")
+
+
+def watch_docs(
+    path_pdf: Path = PATH_SAINT_AMAND_INTEGRAL,
+    interval: float = WATCH_INTERVAL_SECONDS,
+) -> None:
+    # poll the integral and update the infos each time it changes
+    last_stat = None
+    while True:
+        stat = _get_stat(path_pdf)
+        if stat is not None and stat != last_stat:
+            try:
+                run_update(path_pdf)
+                last_stat = stat
+            except Exception as e:
+                print(f"Update of Saint-Amand infos failed : {e}")
+        time.sleep(interval)
+
+
+def start_watcher() -> None:
+    # once per process
+    global _watcher
+    with _lock_watcher:
+        if _watcher is None:
+            _watcher = threading.Thread(target=watch_docs, daemon=True)
+            _watcher.start()
+
+
+if __name__ == "__main__":
+    import fire
+
+    fire.Fire({"update": run_update, "watch": watch_docs})
@@ -5,10 +5,10 @@ import pandas as pd
 
 from backend.saint_amand.extract_all_infos import (
     convert_filters_to_args,
-    extract_infos_saint_amand,
     filter_compressed,
     load_df_compressed,
 )
+from backend.saint_amand.update import run_update
 from frontend.filters import Filters
 from helper.write_docx import LIGHT_BLUE, LIGHT_GREY, WD_PARAGRAPH_ALIGNMENT, DocxWriter
 from vars import PATH_TMP
@@ -66,7 +66,7 @@ def write_chrono(
 
         # fields to string
         df["dates"] = df["dates"].apply(
-            lambda dates: ", ".join(date.strftime("%d-%m-%Y") for date in dates)
+            lambda dates: ", ".join(pd.to_datetime(dates).strftime("%d-%m-%Y"))
         )
         for col in ["nums_cr", "pages"]:
             df[col] = df[col].apply(lambda lst: ", ".join(str(e) for e in lst))
@@ -96,14 +96,12 @@ def extract_infos_and_write_doc(path_docx_to_write: Path, filters: Filters) -> N
 
     filters_args = convert_filters_to_args(filters)
 
-    # 1. get infos
+    # 1. get infos (extracted in a fresh process, not in the threads of the server)
     df_compressed = load_df_compressed()
-    if df_compressed is not None:
-        df_compressed = filter_compressed(df_compressed, **filters_args)
-    else:  # need to compute
-        _, _, df_compressed = extract_infos_saint_amand(
-            projects_to_extract=filters.projects, **filters_args
-        )
+    if df_compressed is None:
+        run_update()
+        df_compressed = load_df_compressed()
+    df_compressed = filter_compressed(df_compressed, **filters_args)
 
     # 2. write
 
@@ -5,6 +5,7 @@ sys.path.append("src/")
 
 import streamlit as st
 
+from backend.saint_amand.update import start_watcher
 from frontend import (
     page_chatbot_custom,
     page_chatbot_saintamand,
@@ -15,6 +16,9 @@ PAGE1 = "Question-Réponse  \nSaint-Amand"
 PAGE2 = "Chronologie  \nSaint-Amand"
 PAGE3 = "Question-Réponse  \nPersonalisable"
 
+# --- Keep the Saint-Amand infos up to date with the integral
+start_watcher()
+
 # --- Initialize selected page in session state
 if "page" not in st.session_state:
     st.session_state.page = PAGE1
@@ -1,65 +1,298 @@
+import copy
+import hashlib
 import json
 import os
+import pickle
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Any, Optional
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
 
 import numpy as np
 import pandas as pd
-import torch
 
 from vars import PATH_CACHE
 
+try:
+    import fcntl
+except ImportError:  # windows : the locks are only between threads
+    fcntl = None
+
+FOLDER_LOCKS = ".locks"
+
+# objects loaded in this process, bounded by their size on disk
+MEMORY_BUDGET_BYTES = 512 * 1024**2
+# files of the cache sub-folders (index, pipeline outputs, ...), the least
+# recently used being evicted first. The files at the root are never evicted.
+DISK_BUDGET_BYTES = 10 * 1024**3
+
+# hits_memory, hits_disk, misses, bytes_read, bytes_written, evictions
+stats: Counter = Counter()
+
+# filename -> ((mtime, size) of the file, object)
+_memory: "OrderedDict[str, Tuple[Tuple[int, int], Any]]" = OrderedDict()
+_memory_bytes = 0
+_disk_bytes: Optional[int] = None
+
+_lock_state = threading.Lock()
+_locks_threads: Dict[str, threading.Lock] = {}
+
 
 def check_filename(filename: str) -> None:
     if "/" in filename:
         raise ValueError(f"Must be a simple filename, not a path. Got {filename}")
 
 
-def load(filename: str) -> Optional[Any]:
+def compute_file_hash(path: Path) -> str:
+    sha = hashlib.sha256()
+    with open(path, mode="rb") as fr:
+        while chunk := fr.read(1 << 20):
+            sha.update(chunk)
+    return sha.hexdigest()
 
-    # check_filename(filename)
 
-    path: Path = PATH_CACHE / filename
-    if not path.exists():
-        return None
+def compute_key(obj: Any, length: int = 16) -> str:
+    # key of json-like parameters (content hashes, chunking params, ...)
+    return hashlib.sha1(json.dumps(obj, sort_keys=True).encode()).hexdigest()[:length]
 
-    if path.suffix == "":  # folder
-        obj = []
-        for sub_filename in os.listdir(path):
-            e = load(path / sub_filename)
-            obj.append(e)
-    elif path.suffix == ".json":
+
+def get_stats() -> dict:
+    return dict(stats, memory_bytes=_memory_bytes, disk_bytes=_disk_bytes)
+
+
+# ----------------- Locks -----------------
+
+
+@contextmanager
+def lock(filename: str) -> Iterator[None]:
+    """Exclusive lock on a cache file, between threads and processes."""
+
+    key = compute_key(str(filename))
+    with _lock_state:
+        lock_thread = _locks_threads.setdefault(key, threading.Lock())
+
+    with lock_thread:
+        if fcntl is None:
+            yield
+            return
+
+        path_lock = PATH_CACHE / FOLDER_LOCKS / (key + ".lock")
+        os.makedirs(path_lock.parent, exist_ok=True)
+        with open(path_lock, mode="w") as fl:
+            fcntl.flock(fl, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fl, fcntl.LOCK_UN)
+
+
+# ----------------- Memory tier -----------------
+
+
+def _stamp(path: Path) -> Tuple[int, int]:
+    stat = path.stat()
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _copy(obj: Any) -> Any:
+    # the callers may modify what they load
+    if isinstance(obj, pd.DataFrame):
+        return obj.copy()
+    if isinstance(obj, np.ndarray):
+        return obj.copy()
+    # torch imported lazily : the extraction workers do not need it
+    if "torch" in sys.modules and isinstance(obj, sys.modules["torch"].Tensor):
+        return obj.clone()
+    return copy.deepcopy(obj)
+
+
+def _forget(filename: str) -> None:
+    global _memory_bytes
+    entry = _memory.pop(filename, None)
+    if entry is not None:
+        _memory_bytes -= entry[0][1]
+
+
+def _remember(filename: str, stamp: Tuple[int, int], obj: Any) -> None:
+    global _memory_bytes
+    if stamp[1] > MEMORY_BUDGET_BYTES:
+        return
+
+    with _lock_state:
+        _forget(filename)
+        _memory[filename] = stamp, _copy(obj)
+        _memory_bytes += stamp[1]
+
+        while _memory_bytes > MEMORY_BUDGET_BYTES:
+            _forget(next(iter(_memory)))
+
+
+# ----------------- Disk tier -----------------
+
+
+def _iter_evictable() -> Iterator[Path]:
+    for path_folder in PATH_CACHE.iterdir():
+        if path_folder.is_dir() and path_folder.name != FOLDER_LOCKS:
+            yield from (path for path in path_folder.rglob("*") if path.is_file())
+
+
+def _add_disk_bytes(nb_bytes: int) -> None:
+    global _disk_bytes
+    with _lock_state:
+        if _disk_bytes is None:
+            _disk_bytes = sum(path.stat().st_size for path in _iter_evictable())
+        _disk_bytes += nb_bytes
+        over_budget = _disk_bytes > DISK_BUDGET_BYTES
+
+    if over_budget:
+        evict()
+
+
+def evict(budget: int = DISK_BUDGET_BYTES) -> None:
+    """Remove the least recently used files of the sub-folders over the budget."""
+
+    global _disk_bytes
+    files = []
+    for path in _iter_evictable():
+        stat = path.stat()
+        files.append((stat.st_atime_ns, stat.st_size, path))
+    files.sort()
+
+    total = sum(size for _, size, _ in files)
+    for _, size, path in files:
+        if total <= budget:
+            break
+        path.unlink(missing_ok=True)
+        with _lock_state:
+            _forget(str(path.relative_to(PATH_CACHE)))
+        total -= size
+        stats["evictions"] += 1
+
+    with _lock_state:
+        _disk_bytes = total
+
+
+def _touch(path: Path) -> None:
+    # access time kept by hand : the filesystem may not update it
+    try:
+        os.utime(path, ns=(time.time_ns(), path.stat().st_mtime_ns))
+    except FileNotFoundError:  # evicted meanwhile
+        pass
+
+
+# ----------------- Load -----------------
+
+
+def _is_evictable(path: Path) -> bool:
+    return path.parent != PATH_CACHE
+
+
+def _is_memory_mapped(path: Path) -> bool:
+    # shared between the processes by the page cache, not copied in memory
+    return path.suffix == ".npy"
+
+
+def _sort_key_folder(filename: str) -> Tuple[int, str]:
+    # files of a saved list are named by their index
+    stem = Path(filename).stem
+    return (int(stem) if stem.isdigit() else -1), filename
+
+
+def exists(filename: str) -> bool:
+    return (PATH_CACHE / filename).exists()
+
+
+def _read(path: Path) -> Any:
+    if path.suffix == ".json":
         with open(path, mode="r") as fr:
             obj = json.load(fr)
     elif path.suffix == ".pt":
+        import torch
+
         obj = torch.load(path, weights_only=False)
     elif path.suffix == ".csv":
         obj = pd.read_csv(path)
+    elif path.suffix == ".parquet":  # typed columns, lists and dates included
+        obj = pd.read_parquet(path, memory_map=True)
+    elif path.suffix == ".npy":  # read-only
+        obj = np.load(path, mmap_mode="r")
+    elif path.suffix == ".pkl":
+        with open(path, mode="rb") as fr:
+            obj = pickle.load(fr)
     else:
         raise ValueError(f"Extension '{path.suffix}' not handled")
 
     return obj
 
 
-def save(filename: str, obj: Any, ext: Optional[str] = None) -> None:
+def load(filename: str, memory_tier: bool = True) -> Optional[Any]:
+    # memory_tier=False : objects the caller shares itself, not copied here
 
     # check_filename(filename)
 
-    path = PATH_CACHE / filename
+    path: Path = PATH_CACHE / filename
+    if not path.exists():
+        stats["misses"] += 1
+        return None
 
-    if path.suffix == "":  # folder
-        if not isinstance(obj, list):
-            raise ValueError(f"Folder is only handled with a list, got {type(obj)}")
-        if ext is None:
-            raise ValueError("To save a folder, the extension precision is mandatory.")
+    if path.suffix == "":  # folder, in the order of the saved list
+        return [
+            load(Path(filename) / sub_filename, memory_tier)
+            for sub_filename in sorted(os.listdir(path), key=_sort_key_folder)
+            if not sub_filename.startswith(".")  # files being written
+        ]
+
+    # 1. memory, if the file did not change since
+    key = str(filename)
+    try:
+        stamp = _stamp(path)
+    except FileNotFoundError:  # evicted meanwhile
+        stats["misses"] += 1
+        return None
 
-        os.makedirs(path, exist_ok=True)
-        for idx, sub_obj in enumerate(obj):
-            save(Path(filename) / (str(idx) + ext), sub_obj)
-    elif path.suffix == ".json":
+    with _lock_state:
+        entry = _memory.get(key)
+        if entry is not None and entry[0] == stamp:
+            _memory.move_to_end(key)
+            stats["hits_memory"] += 1
+            obj = entry[1]
+        else:
+            obj = None
+    if obj is not None:
+        if _is_evictable(path):
+            _touch(path)
+        return _copy(obj)
+
+    # 2. disk : the writes are atomic, no lock needed
+    try:
+        obj = _read(path)
+    except FileNotFoundError:
+        stats["misses"] += 1
+        return None
+    stats["hits_disk"] += 1
+    stats["bytes_read"] += stamp[1]
+
+    if _is_evictable(path):
+        _touch(path)
+    if memory_tier and not _is_memory_mapped(path):
+        _remember(key, stamp, obj)
+
+    return obj
+
+
+# ----------------- Save -----------------
+
+
+def _write(path: Path, obj: Any) -> None:
+    if path.suffix == ".json":
         with open(path, mode="w") as fw:
             json.dump(obj, fw)
     elif path.suffix == ".pt":
+        import torch
+
         if not isinstance(obj, torch.Tensor) and not isinstance(obj, np.ndarray):
             raise ValueError(
                 f"Extension '.pt' is only handled with a tensor or a numpy array, got {type(obj)}"
@@ -71,5 +304,85 @@ def save(filename: str, obj: Any, ext: Optional[str] = None) -> None:
                 f"Extension '.csv' is only handled with a dataframe, got {type(obj)}"
             )
         obj.to_csv(path, index=False)
+    elif path.suffix == ".parquet":
+        if not isinstance(obj, pd.DataFrame):
+            raise ValueError(
+                f"Extension '.parquet' is only handled with a dataframe, got {type(obj)}"
+            )
+        obj.to_parquet(path, index=False)
+    elif path.suffix == ".npy":
+        if not isinstance(obj, np.ndarray):
+            raise ValueError(
+                f"Extension '.npy' is only handled with a numpy array, got {type(obj)}"
+            )
+        np.save(path, obj)
+    elif path.suffix == ".pkl":
+        with open(path, mode="wb") as fw:
+            pickle.dump(obj, fw)
     else:
         raise ValueError(f"Extension '{path.suffix}' not handled")
+
+
+def _save_file(filename: str, obj: Any) -> None:
+    path = PATH_CACHE / filename
+    os.makedirs(path.parent, exist_ok=True)
+
+    # written aside then renamed : readers never see a partial file
+    path_tmp = path.with_name(
+        f".{path.stem}.{os.getpid()}.{threading.get_ident()}.tmp{path.suffix}"
+    )
+    try:
+        _write(path_tmp, obj)
+        size_old = path.stat().st_size if path.exists() else 0
+        os.replace(path_tmp, path)
+    finally:
+        path_tmp.unlink(missing_ok=True)
+
+    # the next load reads the file : its types may differ from the object saved
+    size = path.stat().st_size
+    stats["bytes_written"] += size
+    with _lock_state:
+        _forget(str(filename))
+    if _is_evictable(path):
+        _add_disk_bytes(size - size_old)
+
+
+def save(filename: str, obj: Any, ext: Optional[str] = None) -> None:
+
+    # check_filename(filename)
+
+    path = PATH_CACHE / filename
+
+    if path.suffix == "":  # folder
+        if not isinstance(obj, list):
+            raise ValueError(f"Folder is only handled with a list, got {type(obj)}")
+        if ext is None:
+            raise ValueError("To save a folder, the extension precision is mandatory.")
+
+        with lock(filename):
+            os.makedirs(path, exist_ok=True)
+            for idx, sub_obj in enumerate(obj):
+                _save_file(Path(filename) / (str(idx) + ext), sub_obj)
+    else:
+        with lock(filename):
+            _save_file(filename, obj)
+
+
+def update(filename: str, func: Callable[[Optional[Any]], Any]) -> Any:
+    """
+    Save func(cached object or None) with no concurrent write in between, for
+    the caches merged by several sessions or processes. Return the saved object.
+    """
+
+    with lock(filename):
+        obj = func(load(filename))
+        _save_file(filename, obj)
+
+    return obj
+
+
+def update_dict(filename: str, obj: dict) -> dict:
+    # merge into the cached dict, keeping the keys saved by the others meanwhile
+    return update(
+        filename, lambda cached: {**(cached if isinstance(cached, dict) else {}), **obj}
+    )
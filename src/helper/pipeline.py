@@ -0,0 +1,149 @@
+import hashlib
+import inspect
+import re
+import sys
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from pathlib import Path
+from types import ModuleType
+from typing import Any, Callable, Dict, List, Optional
+
+from helper import cache
+
+FOLDER_PIPELINE = "pipeline"
+
+
+@dataclass
+class Stage:
+    name: str
+    func: Callable[..., Any]
+    # stages whose outputs are the positional arguments of func, in order
+    inputs: List[str] = field(default_factory=list)
+    # keyword arguments of func
+    params: Dict[str, Any] = field(default_factory=dict)
+    # files read by func, fingerprinted by content
+    files: List[Path] = field(default_factory=list)
+    # code of func beyond its own module
+    modules: List[ModuleType] = field(default_factory=list)
+
+
+def _hash_module(module: ModuleType) -> str:
+    with open(inspect.getsourcefile(module), mode="rb") as fr:
+        return hashlib.sha1(fr.read()).hexdigest()
+
+
+class Pipeline:
+    """
+    DAG of stages whose outputs are cached under a fingerprint of their inputs,
+    params, files and code. A run executes only the stale stages needed by the
+    targets, independent ones concurrently, and saves each output as soon as
+    it is computed : a run resumes after a crash.
+    """
+
+    def __init__(self, stages: List[Stage], folder: str = FOLDER_PIPELINE):
+        self.stages = {stage.name: stage for stage in stages}
+        self.folder = folder
+
+        for stage in stages:
+            for name in stage.inputs:
+                if name not in self.stages:
+                    raise ValueError(f"Stage '{stage.name}' : unknown input '{name}'")
+
+        self.fingerprints: Dict[str, str] = {}
+        for name in self.stages:
+            self._compute_fingerprint(name, visiting=set())
+
+    def _compute_fingerprint(self, name: str, visiting: set) -> str:
+        if name in self.fingerprints:
+            return self.fingerprints[name]
+        if name in visiting:
+            raise ValueError(f"Cycle in the pipeline at stage '{name}'")
+        visiting.add(name)
+
+        stage = self.stages[name]
+        modules = [sys.modules[stage.func.__module__], *stage.modules]
+        description = {
+            "name": name,
+            "func": stage.func.__qualname__,
+            "params": repr(sorted(stage.params.items())),
+            "code": [_hash_module(module) for module in modules],
+            "files": [cache.compute_file_hash(path) for path in stage.files],
+            "inputs": [self._compute_fingerprint(n, visiting) for n in stage.inputs],
+        }
+        self.fingerprints[name] = cache.compute_key(description)
+
+        return self.fingerprints[name]
+
+    def _basename(self, name: str) -> str:
+        return re.sub(r"[^0-9A-Za-z]+", "_", name)
+
+    def _filename(self, name: str) -> str:
+        return f"{self.folder}/{self._basename(name)}_{self.fingerprints[name]}.pkl"
+
+    def is_stale(self, name: str) -> bool:
+        return not cache.exists(self._filename(name))
+
+    def _save(self, name: str, output: Any) -> None:
+        # atomic : a crash never leaves a partial output
+        filename = self._filename(name)
+        cache.save(filename, output)
+
+        # remove the outputs of the previous fingerprints
+        pattern = re.compile(rf"{re.escape(self._basename(name))}_[0-9a-f]{{16}}\.pkl")
+        for path in (cache.PATH_CACHE / self.folder).iterdir():
+            if pattern.fullmatch(path.name) and path.name != Path(filename).name:
+                path.unlink()
+
+    def run(
+        self, targets: Optional[List[str]] = None, max_workers: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """Outputs of the targets (all the stages by default)."""
+
+        targets = targets or list(self.stages)
+
+        # 1. stages to execute : the stale ones needed by the targets
+        to_run, to_load = set(), set()
+        stack = list(targets)
+        while stack:
+            name = stack.pop()
+            if name in to_run or name in to_load:
+                continue
+            if self.is_stale(name):
+                to_run.add(name)
+                stack.extend(self.stages[name].inputs)
+            else:
+                to_load.add(name)
+
+        # 2. load the fresh outputs
+        outputs: Dict[str, Any] = {}
+        for name in to_load:
+            outputs[name] = cache.load(self._filename(name))
+        print(f"Pipeline : {len(to_load)} stages cached, {len(to_run)} to run")
+
+        # 3. execute the stale stages once their inputs are ready
+        def execute(name: str) -> Any:
+            stage = self.stages[name]
+            print(f"Pipeline : running '{name}'...")
+            output = stage.func(*(outputs[n] for n in stage.inputs), **stage.params)
+            self._save(name, output)
+            return output
+
+        pending = set(to_run)
+        running: Dict[Future, str] = {}
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while pending or running:
+                ready = [
+                    name
+                    for name in pending
+                    if all(n in outputs for n in self.stages[name].inputs)
+                ]
+                for name in ready:
+                    pending.remove(name)
+                    running[executor.submit(execute, name)] = name
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    # an exception stops the run, the finished stages stay saved
+                    outputs[running.pop(future)] = future.result()
+
+        return {name: outputs[name] for name in targets}